@@ -0,0 +1,87 @@
+"""Compares DassanaWriter encoder backends on finding-like records.
+
+Checks first that every installed backend writes the same bytes for the same records, with and without
+exact_decimals, exits with 1 if not.
+
+Usage: python benchmarks/encoder_benchmark.py [record_count]
+"""
+import datetime
+import decimal
+import random
+import sys
+import timeit
+import uuid
+
+from dassana.dassana_encoder import encoders, get_encoder
+
+
+def build_finding(i):
+    now = datetime.datetime(2024, 3, 12, 10, 30, tzinfo=datetime.timezone.utc)
+    return {
+        "id": str(uuid.uuid4()),
+        "assetId": uuid.uuid4(),
+        "title": f"CVE-2024-{1000 + i} in openssl package",
+        "severity": random.choice(["low", "medium", "high", "critical"]),
+        "cvssScore": decimal.Decimal("7.5"),
+        "firstSeen": now - datetime.timedelta(days=i % 90),
+        "lastSeen": now,
+        "tags": ["prod", "us-east-1", "team:platform"],
+        "asset": {
+            "hostname": f"ip-10-0-{i % 255}-{i % 7}.ec2.internal",
+            "os": "Amazon Linux 2",
+            "ipAddresses": [f"10.0.{i % 255}.{i % 7}", "172.31.0.4"],
+            "cloud": {"provider": "aws", "accountId": "123456789012", "region": "us-east-1"},
+        },
+        "packages": [
+            {"name": "openssl", "version": "1.0.2k", "fixedIn": "1.0.2k-26"},
+            {"name": "openssl-libs", "version": "1.0.2k", "fixedIn": "1.0.2k-26"},
+        ],
+        "description": "A buffer overrun can be triggered in X.509 certificate verification. " * 4,
+    }
+
+
+# Values the backends are known to disagree on unless the encoders normalize them
+EDGE_CASES = [
+    {"decimal": decimal.Decimal("12345678901234567890.123456789"), "small": decimal.Decimal("0.1")},
+    {"path": "a/b/c", "unicode": "caf\u00e9 \u2603", "quote": "say \"hi\"\n"},
+    {"nested": [{"value": decimal.Decimal("1E+2")}, (1, 2.5, None, True)], 1: "int key"},
+    {"date": datetime.date(2024, 3, 12), "time": datetime.time(10, 30, 1, 5),
+     "naive": datetime.datetime(2024, 3, 12, 10, 30), "uuid": uuid.UUID(int=7)},
+]
+
+
+def check_consistency(available, records):
+    reference_name, reference = next(iter(available.items()))
+    mismatches = 0
+    for name, encoder in available.items():
+        for record in records:
+            if encoder(record) != reference(record):
+                mismatches += 1
+                print(f"FAIL: {name} and {reference_name} differ: {encoder(record)!r} != {reference(record)!r}")
+                break
+    return mismatches
+
+
+def main():
+    record_count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    records = [build_finding(i) for i in range(record_count)]
+    available = {}
+    for name in encoders:
+        try:
+            available[name] = get_encoder(name)
+        except ImportError as exp:
+            print(f"{name:>8}: skipped ({exp})")
+    exact = {name: get_encoder(name, exact_decimals=True) for name in available}
+    if check_consistency(available, EDGE_CASES + records[:100]) or check_consistency(exact, EDGE_CASES):
+        return 1
+    for name, encoder in available.items():
+        output_bytes = sum(len(encoder(record)) for record in records)
+        runs = timeit.repeat(lambda: [encoder(record) for record in records], number=1, repeat=5)
+        best = min(runs)
+        print(f"{name:>8}: {best * 1000:8.1f} ms  {record_count / best:10.0f} records/s  "
+              f"{output_bytes / best / 1000 / 1000:7.1f} MB/s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,50 @@
+"""Measures the cold import time of the dassana package and checks no cloud SDK is imported with it.
+
+Every run imports dassana in a fresh interpreter without any DASSANA_* variables set. Exits with 1 when a
+cloud SDK shows up in sys.modules or the median import time exceeds the budget.
+
+Usage: python benchmarks/import_benchmark.py [runs] [budget_ms]
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# Only imported once a stage or the publisher of that kind is used
+LAZY_MODULES = ("boto3", "botocore", "google.cloud.storage", "google.cloud.pubsub_v1", "aiohttp", "zstandard",
+                "ijson")
+
+PROBE = f"""
+import json, sys, time
+start = time.perf_counter()
+import dassana
+elapsed = time.perf_counter() - start
+print(json.dumps({{"elapsed": elapsed, "loaded": [m for m in {LAZY_MODULES!r} if m in sys.modules]}}))
+"""
+
+
+def import_once():
+    env = {key: value for key, value in os.environ.items() if not key.startswith("DASSANA_")}
+    output = subprocess.run([sys.executable, "-c", PROBE], env=env, check=True, capture_output=True, text=True)
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    budget = float(sys.argv[2]) if len(sys.argv) > 2 else 500
+    results = [import_once() for _ in range(runs)]
+    times = [result["elapsed"] * 1000 for result in results]
+    loaded = sorted({module for result in results for module in result["loaded"]})
+    median = statistics.median(times)
+    print(f"import dassana: min {min(times):.1f} ms  median {median:.1f} ms  max {max(times):.1f} ms  "
+          f"({runs} runs, budget {budget:.0f} ms)")
+    if loaded:
+        print(f"FAIL: imported eagerly: {', '.join(loaded)}")
+    if median > budget:
+        print("FAIL: median import time over budget")
+    return 1 if loaded or median > budget else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
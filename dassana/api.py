@@ -1,21 +1,92 @@
 import timeit
+import threading
 import requests
+from http.cookiejar import DefaultCookiePolicy
+from requests.adapters import HTTPAdapter
 from requests.models import Response
 import logging
-from tenacity import retry, stop_after_attempt, before_sleep_log, retry_if_exception, wait_exponential
 from typing import Final
 from requests.exceptions import Timeout, HTTPError, ConnectionError, RequestException
-from .dassana_exception import ApiRequest, ApiResponse, ApiError, NetworkError, ServerError, RateLimitError, AuthError
+from .dassana_exception import ApiResponse, ApiError, NetworkError, ServerError, RateLimitError, AuthError, \
+    DeferredApiRequest, DeferredApiResponse
+from .dassana_metrics import get_request_size, get_response_size, metrics
+from .dassana_ratelimit import get_rate_limiter
+from .dassana_retry import get_retry_policy
 from requests.compat import (
     basestring,
     urlencode
 )
 from requests.utils import to_key_val_list
-from json import dumps as json_dumps
+from urllib.parse import urlsplit
 
 logger: Final = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
+# One keep-alive session per scheme and host, so repeated calls to the same service reuse connections instead of
+# paying for a new TCP and TLS handshake every time. Sessions are shared by all threads, pool_maxsize caps the
+# connections kept open per host and pool_block makes callers wait for a free connection instead of opening more.
+session_config = {
+    "keep_alive": True,
+    "pool_maxsize": 10,
+    "pool_block": False,
+    "host_limits": {},
+}
+sessions = {}
+sessions_lock = threading.Lock()
+
+
+def configure_sessions(keep_alive=None, pool_maxsize=None, pool_block=None, host_limits=None):
+    """Changes the connection pool settings used by call_api, host_limits maps a host to its own pool_maxsize."""
+    with sessions_lock:
+        if keep_alive is not None:
+            session_config["keep_alive"] = keep_alive
+        if pool_maxsize is not None:
+            session_config["pool_maxsize"] = pool_maxsize
+        if pool_block is not None:
+            session_config["pool_block"] = pool_block
+        if host_limits is not None:
+            session_config["host_limits"] = dict(host_limits)
+        close_sessions_locked()
+
+
+def close_sessions():
+    with sessions_lock:
+        close_sessions_locked()
+
+
+def close_sessions_locked():
+    for session in sessions.values():
+        session.close()
+    sessions.clear()
+
+
+def get_session(url):
+    parts = urlsplit(url)
+    key = f"{parts.scheme}://{parts.netloc}".lower()
+    session = sessions.get(key)
+    if session is not None:
+        return session
+    with sessions_lock:
+        if key not in sessions:
+            sessions[key] = create_session(key, parts.hostname)
+        return sessions[key]
+
+
+def create_session(prefix, host):
+    session = requests.Session()
+    # requests.request never carried cookies from one call to the next, shared sessions must not either
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    pool_maxsize = session_config["host_limits"].get(host, session_config["pool_maxsize"])
+    session.mount(prefix, HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize,
+                                      pool_block=session_config["pool_block"]))
+    return session
+
+
+def send_request(method, url, **kwargs):
+    if not session_config["keep_alive"]:
+        return requests.request(method, url, **kwargs)
+    return get_session(url).request(method, url, **kwargs)
+
 
 def encode_params(data):
     """Encode parameters in a piece of data.
@@ -51,52 +122,77 @@ def encode_params(data):
 
 def call_api(method, url, data=None, json=None, auth=None, headers=None, params=None, cookies=None, timeout=300,
              verify=True, is_internal=False, ignore_not_found_error=False, new_status_validator=None,
-             do_not_track_request_body=False) -> Response:
+             do_not_track_request_body=False, retry_policy=None, retry_budget=None, rate_limiter=None,
+             stream=False) -> Response:
+    # With stream the body is left unread for the caller to consume incrementally, see dassana_stream
     api_start_ts = timeit.default_timer()
     try:
         response = api_request(method, url, data, json, auth, headers, params, cookies, timeout, verify, is_internal,
-                               ignore_not_found_error, new_status_validator, do_not_track_request_body)
+                               ignore_not_found_error, new_status_validator, do_not_track_request_body,
+                               retry_policy, retry_budget, rate_limiter, stream)
         api_end_ts = timeit.default_timer()
+        metrics.record_call(method, url, api_end_ts - api_start_ts)
         logging.debug(f"API request successful (url - {url} body - {data or json})")
         return response
     except ApiError as e:
         api_end_ts = timeit.default_timer()
+        metrics.record_call(method, url, api_end_ts - api_start_ts, failed=True)
         logging.error(f"{str(e)}")
         raise e
 
 
-@retry(
-    retry=retry_if_exception(lambda e: isinstance(e, ApiError) and e.is_auto_recoverable),
-    wait=wait_exponential(multiplier=5, min=30, max=60),
-    stop=stop_after_attempt(3),
-    before_sleep=before_sleep_log(logger, logging.WARNING),
-    reraise=True)
 def api_request(method, url, data=None, json=None, auth=None, headers=None, params=None, cookies=None, timeout=300,
                 verify=True, is_internal=False, ignore_not_found_error=False, new_status_validator=None,
-                do_not_track_request_body=False) -> Response:
-    global status_validator
-    http_request = ApiRequest(method, url,
-                              (json_dumps(json) if json is not None else encode_params(data))
-                              if not do_not_track_request_body else None)
+                do_not_track_request_body=False, retry_policy=None, retry_budget=None, rate_limiter=None,
+                stream=False) -> Response:
+    # retry_policy and rate_limiter override the ones configured for the host, retry_budget caps the retries of a
+    # whole job
+    return get_retry_policy(url, retry_policy).call(url, api_attempt, method, url, data, json, auth, headers, params,
+                                                    cookies, timeout, verify, is_internal, ignore_not_found_error,
+                                                    new_status_validator, do_not_track_request_body,
+                                                    get_rate_limiter(url, rate_limiter), stream, budget=retry_budget)
+
+
+def api_attempt(method, url, data=None, json=None, auth=None, headers=None, params=None, cookies=None, timeout=300,
+                verify=True, is_internal=False, ignore_not_found_error=False, new_status_validator=None,
+                do_not_track_request_body=False, rate_limiter=None, stream=False) -> Response:
+    # The request body is only serialized and the response body only decoded when the call fails
+    http_request = DeferredApiRequest(method, url, json, data, track_body=not do_not_track_request_body)
+    attempt_start_ts = None
     try:
-        response = requests.request(method, url, headers=headers, data=data, json=json, params=params, auth=auth,
-                                    timeout=timeout, cookies=cookies, verify=verify)
-        http_response = ApiResponse().from_response(response)
-        status_validator = new_status_validator or status_validator
-        status_validator(http_request, http_response, is_internal, ignore_not_found_error)
+        if rate_limiter is not None:
+            rate_limiter.acquire()
+        attempt_start_ts = timeit.default_timer()
+        response = send_request(method, url, headers=headers, data=data, json=json, params=params, auth=auth,
+                                timeout=timeout, cookies=cookies, verify=verify, stream=stream)
+        metrics.record_attempt(method, url, response.status_code, timeit.default_timer() - attempt_start_ts,
+                               get_request_size(response, data), get_response_size(response))
+        if rate_limiter is not None:
+            rate_limiter.observe(response.status_code, response.headers)
+        http_response = DeferredApiResponse(response)
+        validator = new_status_validator or status_validator
+        validator(http_request, http_response, is_internal, ignore_not_found_error)
         return response
     except (ConnectionError, Timeout) as exp:
+        record_failed_attempt(method, url, exp, attempt_start_ts)
         raise NetworkError(http_request, exp, is_internal=is_internal)
     except HTTPError as httpError:
         raise ApiError(http_request, ApiResponse().from_response(httpError.response), is_internal=is_internal,
                        is_auto_recoverable=True)
     except RequestException as requestError:
+        record_failed_attempt(method, url, requestError, attempt_start_ts)
         raise ApiError(http_request, ApiResponse().from_response(requestError.response), error_details=requestError,
                        is_internal=is_internal, is_auto_recoverable=True)
     except ApiError as apiError:
         raise apiError
 
 
+def record_failed_attempt(method, url, exp, attempt_start_ts):
+    # Attempts that got no response at all are counted under the exception instead of a status code
+    if attempt_start_ts is not None:
+        metrics.record_attempt(method, url, exp.__class__.__name__, timeit.default_timer() - attempt_start_ts)
+
+
 def status_validator(http_request, http_response, is_internal, ignore_not_found_error):
     if int(http_response.status_code / 100) == 2:
         return
@@ -114,3 +210,9 @@ def status_validator(http_request, http_response, is_internal, ignore_not_found_
         raise ServerError(http_request, http_response, is_internal=is_internal)
     else:
         raise ApiError(http_request, http_response, is_internal=is_internal, is_auto_recoverable=True)
+
+
+def not_modified_validator(http_request, http_response, is_internal, ignore_not_found_error):
+    # For conditional requests, a 304 means the cached copy is still current
+    if http_response.status_code != 304:
+        status_validator(http_request, http_response, is_internal, ignore_not_found_error)
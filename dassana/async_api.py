@@ -0,0 +1,164 @@
+import asyncio
+import logging
+import ssl
+import threading
+import timeit
+from json import loads as json_loads
+from typing import Final
+
+import aiohttp
+
+from .api import record_failed_attempt, session_config, status_validator
+from .dassana_exception import ApiResponse, ApiError, DeferredApiRequest, DeferredApiResponse, NetworkError
+from .dassana_metrics import get_request_size, get_response_size, metrics
+from .dassana_ratelimit import get_rate_limiter
+from .dassana_retry import get_retry_policy
+
+logger: Final = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+# aiohttp sessions belong to the event loop they were created on, keep one per loop together with the generator
+# closing it when the loop shuts down
+async_sessions = {}
+async_sessions_lock = threading.Lock()
+
+
+class AsyncResponse:
+    """Fully read response returned by call_api_async, mirrors the parts of requests.Response connectors use."""
+
+    def __init__(self, method, url, status_code, reason, headers, content, encoding=None):
+        self.method = method
+        self.url = url
+        self.status_code = status_code
+        self.reason = reason
+        self.headers = headers
+        self.content = content
+        self.encoding = encoding or "utf-8"
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding, errors="replace")
+
+    def json(self):
+        return json_loads(self.content)
+
+
+async def close_on_shutdown(loop, session):
+    # The loop finalizes async generators that are still suspended in shutdown_asyncgens, which asyncio.run calls
+    # before closing the loop, so the session is closed even when close_async_sessions is never awaited
+    try:
+        yield
+    finally:
+        with async_sessions_lock:
+            if async_sessions.get(loop, (None,))[0] is session:
+                del async_sessions[loop]
+        await session.close()
+
+
+def get_async_session():
+    loop = asyncio.get_running_loop()
+    with async_sessions_lock:
+        # Loops closed without shutting down their async generators leave their entry behind
+        for closed_loop in [other for other in async_sessions if other.is_closed()]:
+            del async_sessions[closed_loop]
+        session = async_sessions.get(loop, (None,))[0]
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(limit=0, limit_per_host=session_config["pool_maxsize"],
+                                             force_close=not session_config["keep_alive"])
+            # requests.request never carried cookies from one call to the next, the shared session must not either
+            session = aiohttp.ClientSession(connector=connector, cookie_jar=aiohttp.DummyCookieJar())
+            closer = close_on_shutdown(loop, session)
+            # Runs the generator up to its yield, which registers it with the running loop
+            try:
+                closer.asend(None).send(None)
+            except StopIteration:
+                pass
+            async_sessions[loop] = (session, closer)
+        return session
+
+
+def get_ssl(verify):
+    # requests accepts a CA bundle path as verify, aiohttp wants an SSLContext for that
+    if isinstance(verify, str):
+        return ssl.create_default_context(cafile=verify)
+    return bool(verify)
+
+
+async def close_async_sessions():
+    loop = asyncio.get_running_loop()
+    with async_sessions_lock:
+        session, closer = async_sessions.pop(loop, (None, None))
+    if session is not None:
+        await session.close()
+        await closer.aclose()
+
+
+async def call_api_async(method, url, data=None, json=None, auth=None, headers=None, params=None, cookies=None,
+                         timeout=300, verify=True, is_internal=False, ignore_not_found_error=False,
+                         new_status_validator=None, do_not_track_request_body=False, retry_policy=None,
+                         retry_budget=None, rate_limiter=None) -> AsyncResponse:
+    api_start_ts = timeit.default_timer()
+    try:
+        response = await api_request_async(method, url, data, json, auth, headers, params, cookies, timeout, verify,
+                                           is_internal, ignore_not_found_error, new_status_validator,
+                                           do_not_track_request_body, retry_policy, retry_budget,
+                                           rate_limiter)
+        api_end_ts = timeit.default_timer()
+        metrics.record_call(method, url, api_end_ts - api_start_ts)
+        logging.debug(f"API request successful (url - {url} body - {data or json})")
+        return response
+    except ApiError as e:
+        api_end_ts = timeit.default_timer()
+        metrics.record_call(method, url, api_end_ts - api_start_ts, failed=True)
+        logging.error(f"{str(e)}")
+        raise e
+
+
+async def api_request_async(method, url, data=None, json=None, auth=None, headers=None, params=None, cookies=None,
+                            timeout=300, verify=True, is_internal=False, ignore_not_found_error=False,
+                            new_status_validator=None, do_not_track_request_body=False, retry_policy=None,
+                            retry_budget=None, rate_limiter=None) -> AsyncResponse:
+    return await get_retry_policy(url, retry_policy).call_async(url, api_attempt_async, method, url, data, json, auth,
+                                                                headers, params, cookies, timeout, verify,
+                                                                is_internal, ignore_not_found_error,
+                                                                new_status_validator, do_not_track_request_body,
+                                                                get_rate_limiter(url, rate_limiter),
+                                                                budget=retry_budget)
+
+
+async def api_attempt_async(method, url, data=None, json=None, auth=None, headers=None, params=None, cookies=None,
+                            timeout=300, verify=True, is_internal=False, ignore_not_found_error=False,
+                            new_status_validator=None, do_not_track_request_body=False,
+                            rate_limiter=None) -> AsyncResponse:
+    # The request body is only serialized and the response body only decoded when the call fails
+    http_request = DeferredApiRequest(method, url, json, data, track_body=not do_not_track_request_body)
+    if isinstance(auth, tuple):
+        auth = aiohttp.BasicAuth(*auth)
+    attempt_start_ts = None
+    try:
+        if rate_limiter is not None:
+            await rate_limiter.acquire_async()
+        attempt_start_ts = timeit.default_timer()
+        async with get_async_session().request(method, url, headers=headers, data=data, json=json, params=params,
+                                               auth=auth, cookies=cookies, ssl=get_ssl(verify),
+                                               timeout=aiohttp.ClientTimeout(total=timeout)) as raw_response:
+            response = AsyncResponse(method, str(raw_response.url), raw_response.status, raw_response.reason,
+                                     raw_response.headers, await raw_response.read(), raw_response.charset)
+        metrics.record_attempt(method, url, response.status_code, timeit.default_timer() - attempt_start_ts,
+                               get_request_size(response, data), get_response_size(response))
+        if rate_limiter is not None:
+            rate_limiter.observe(response.status_code, response.headers)
+        http_response = DeferredApiResponse(response)
+        validator = new_status_validator or status_validator
+        validator(http_request, http_response, is_internal, ignore_not_found_error)
+        return response
+    except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as exp:
+        record_failed_attempt(method, url, exp, attempt_start_ts)
+        raise NetworkError(http_request, exp, is_internal=is_internal)
+    except aiohttp.ClientResponseError as responseError:
+        raise ApiError(http_request, ApiResponse(responseError.status, responseError.message, responseError.headers),
+                       is_internal=is_internal, is_auto_recoverable=True)
+    except aiohttp.ClientError as clientError:
+        record_failed_attempt(method, url, clientError, attempt_start_ts)
+        raise ApiError(http_request, ApiResponse(), error_details=clientError, is_internal=is_internal,
+                       is_auto_recoverable=True)
@@ -0,0 +1,123 @@
+import asyncio
+import logging
+from typing import Final
+
+from .api import not_modified_validator
+from .async_api import call_api_async
+from .common import get_access_token_cache, get_headers, get_ingestion_config_key, ingestion_config_cache, \
+    invalidate_access_token, validate_ingestion_config
+from .dassana_config import get_config
+from .dassana_exception import AuthError
+
+logger: Final = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+
+async def get_headers_async(config=None):
+    config = config or get_config()
+    # Only a token refresh blocks, run that one on a worker thread so it goes through the shared token cache
+    if config.is_internal_auth and \
+            get_access_token_cache(config.auth_url, config.require("client_id")).peek() is None:
+        return await asyncio.to_thread(get_headers, config)
+    return get_headers(config)
+
+
+async def call_internal_api_async(method, url, config, headers=None, **kwargs):
+    # A 401 or 403 for a cached access token drops it and retries once, see call_internal_api
+    request_headers = {**await get_headers_async(config), **(headers or {})}
+    try:
+        return await call_api_async(method, url, headers=request_headers, is_internal=True, **kwargs)
+    except AuthError:
+        if not config.is_internal_auth:
+            raise
+        # The cache lock is held while a token is fetched, wait for it on a worker thread
+        await asyncio.to_thread(invalidate_access_token, config, request_headers["Authorization"][len("Bearer "):])
+    return await call_api_async(method, url, headers={**await get_headers_async(config), **(headers or {})},
+                                is_internal=True, **kwargs)
+
+
+async def create_ingestion_job_async(source, record_type, config_id, metadata=None, priority=None,
+                                     is_snapshot=False, config=None):
+    config = config or get_config()
+    json_body = {
+        "source": str(source),
+        "recordType": str(record_type),
+        "configId": str(config_id),
+        "is_snapshot": is_snapshot,
+        "priority": priority,
+        "metadata": metadata or {}
+    }
+    if json_body["priority"] is None:
+        del json_body["priority"]
+
+    res = await call_internal_api_async("POST", config.ingestion_service_url + "/job/", config, json=json_body,
+                                        verify=config.verify_ingestion)
+    return res.json()
+
+
+async def patch_ingestion_async(job_id, metadata=None, config=None):
+    config = config or get_config()
+    json_body = {"metadata": metadata or {}}
+    res = await call_internal_api_async("PATCH", config.ingestion_service_url + "/job/" + job_id, config,
+                                        json=json_body, verify=config.verify_ingestion)
+    return res.json()
+
+
+async def update_ingestion_to_done_async(job_id, metadata, config=None):
+    config = config or get_config()
+    json_body = {"metadata": metadata}
+    res = await call_internal_api_async("POST", config.ingestion_service_url + "/job/" + job_id + "/" + "done",
+                                        config, json=json_body, verify=config.verify_ingestion)
+    logger.debug(f"Response Status: {res.status_code}")
+    logger.debug(f"Response Body: {res.text}")
+    return res.json()
+
+
+async def cancel_ingestion_job_async(job_id, metadata, fail_type, config=None):
+    config = config or get_config()
+    json_body = {"metadata": metadata}
+    res = await call_internal_api_async("POST", config.ingestion_service_url + "/job/" + job_id + "/" + fail_type,
+                                        config, json=json_body, verify=config.verify_ingestion)
+    logger.debug(f"Response Status: {res.status_code}")
+    logger.debug(f"Response Body: {res.text}")
+    return res.json()
+
+
+async def get_signing_url_async(job_id, config=None):
+    config = config or get_config()
+    res = await call_internal_api_async("GET", config.ingestion_service_url + "/job/" + job_id + "/" + "signing-url",
+                                        config, verify=config.verify_ingestion)
+    return res.json()["url"]
+
+
+async def get_ingestion_config_async(ingestion_config_id, app_id, use_cache=True, config=None):
+    config = config or get_config()
+    key = get_ingestion_config_key(ingestion_config_id, app_id, config)
+    ingestion_config, etag = ingestion_config_cache.get(key) if use_cache else (None, None)
+    if ingestion_config is not None:
+        return ingestion_config
+    url = f"https://{config.app_url}/app/{app_id}/ingestionConfig/{ingestion_config_id}"
+    headers = {"If-None-Match": etag} if etag else None
+    response = await call_internal_api_async("GET", url, config, headers=headers, verify=config.verify_app,
+                                             new_status_validator=not_modified_validator)
+    if response.status_code == 304:
+        ingestion_config = ingestion_config_cache.renew(key)
+        if ingestion_config is not None:
+            return ingestion_config
+        return await get_ingestion_config_async(ingestion_config_id, app_id, use_cache=False,
+                                                config=config)
+
+    ingestion_config = response.json()
+    validate_ingestion_config(ingestion_config)
+    ingestion_config_cache.put(key, ingestion_config, response.headers.get("ETag"))
+    return ingestion_config
+
+
+async def patch_ingestion_config_async(ingestion_config_id, app_id, payload, config=None):
+    config = config or get_config()
+    url = f"https://{config.app_url}/app/{app_id}/ingestionConfig/{ingestion_config_id}"
+    try:
+        response = await call_internal_api_async("PATCH", url, config, json=payload, verify=config.verify_app)
+    finally:
+        ingestion_config_cache.invalidate(get_ingestion_config_key(ingestion_config_id, app_id, config))
+    return response.text
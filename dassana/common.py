@@ -1,143 +1,384 @@
+import copy
 import datetime
-import gzip
+import itertools
 import logging
+import shutil
+import tempfile
 import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Final
+from uuid import uuid4
 
-import boto3
-import requests
-from google.cloud import storage
-
-from .api import call_api
+from .api import call_api, not_modified_validator, send_request
+from .dassana_compression import GzipCodec, get_codec
+from .dassana_config import DassanaConfig, get_config, set_config
+from .dassana_encoder import datetime_handler, get_encoder
 from .dassana_env import *
 from .dassana_exception import *
-from .dassana_logging import log
+from .dassana_heartbeat import HeartbeatManager
+from .dassana_logging import configure_log_pipeline, flush_logs, get_log_stats, log
+from .dassana_metrics import get_metrics, get_metrics_prometheus, metrics, register_endpoints
+from .dassana_pagination import CursorPaginator, LinkHeaderPaginator, OffsetPaginator, Paginator, paginate
+from .dassana_ratelimit import RateLimiter, configure_rate_limits, get_rate_limit_stats
+from .dassana_retry import RetryBudget, RetryPolicy, configure_retries, get_retry_stats
+from .dassana_rotation import AnyPolicy, MaxAgePolicy, MaxRecordsPolicy, MaxSizePolicy, RotationPolicy
+from .dassana_s3 import S3MultipartWriter
+from .dassana_spool import JobSpool, recover_chunk
+from .dassana_stream import stream_records
 
 logger: Final = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
-job_list = set()
-
-
-def datetime_handler(val):
-    if isinstance(val, datetime.datetime):
-        return val.isoformat()
-    return str(val)
-
 
-def compress_file(file_name):
-    with open(file_name, 'rb') as file_in:
-        with gzip.open(f"{file_name}.gz", 'wb') as file_out:
-            file_out.writelines(file_in)
+def compress_file(file_name, codec=None):
+    codec = codec or GzipCodec()
+    with open(file_name, 'rb') as file_in, open(f"{file_name}{codec.extension}", 'wb') as raw_out:
+        with codec.open(raw_out) as file_out:
+            shutil.copyfileobj(file_in, file_out, 1024 * 1024)
     logger.info("Compressed file completed")
 
 
-def get_headers():
+def get_headers(config=None):
+    config = config or get_config()
     headers = {}
-    if is_internal_auth():
-        access_token = get_access_token()
+    if config.is_internal_auth:
+        access_token = get_access_token(config)
         headers = {
-            "x-dassana-tenant-id": get_tenant_id(),
+            "x-dassana-tenant-id": config.get_tenant_id(),
             "Authorization": f"Bearer {access_token}",
         }
     else:
-        app_token = get_dassana_token()
         headers = {
-            "Authorization": f"Dassana {app_token}"
+            "Authorization": f"Dassana {config.token}"
         }
     return headers
 
 
+def call_internal_api(method, url, config, headers=None, **kwargs):
+    """call_api for the Dassana services, authenticated with the headers of config.
+
+    A 401 or 403 for an access token that is still cached, e.g. one revoked before it expired, drops the token and
+    retries the call once with a fresh one.
+    """
+    request_headers = {**get_headers(config), **(headers or {})}
+    try:
+        return call_api(method, url, headers=request_headers, is_internal=True, **kwargs)
+    except AuthError:
+        if not config.is_internal_auth:
+            raise
+        invalidate_access_token(config, request_headers["Authorization"][len("Bearer "):])
+    return call_api(method, url, headers={**get_headers(config), **(headers or {})}, is_internal=True, **kwargs)
+
+
 def get_exc_str(exc):
     return str(exc).replace("\"", "").replace("'", "").replace("\n", " ").replace("\t", " ")
 
 
-def patch_ingestion(job_id, metadata=None):
+def patch_ingestion(job_id, metadata=None, config=None):
+    config = config or get_config()
     if metadata is None:
         metadata = {}
     json_body = {"metadata": metadata}
-    res = call_api('PATCH', get_ingestion_srv_url() + "/job/" + job_id, headers=get_headers(), json=json_body,
-                   is_internal=True, verify=False if "svc.cluster.local" in get_ingestion_srv_url() else True)
+    res = call_internal_api('PATCH', config.ingestion_service_url + "/job/" + job_id, config, json=json_body,
+                            verify=config.verify_ingestion)
     return res.json()
 
 
-def every(delay, task):
-    next_time = time.time() + delay
-    while True:
-        time.sleep(max(0, next_time - time.time()))
-        task()
-        next_time += (time.time() - next_time) // delay * delay + delay
+# Keeps the ingestion jobs of this process alive, writers register their job and config once the job is created
+heartbeat_manager = HeartbeatManager(lambda job_id, config=None: patch_ingestion(job_id, config=config))
 
 
-def iterate_and_update_job_status():
-    global job_list
-    for job_id in job_list:
-        try:
-            patch_ingestion(job_id)
-            logger.info(f"Updated job status for job id: {job_id}")
-        except Exception as exp:
-            logger.warning(f"Failed to update job ({job_id}) heartbeat due to {exp}")
+def configure_heartbeat(interval=None, jitter=None, workers=None):
+    heartbeat_manager.configure(interval=interval, jitter=jitter, workers=workers)
+
+
+def shutdown_heartbeat(wait=True):
+    heartbeat_manager.shutdown(wait=wait)
+
+
+class IngestionConfigCache:
+    """Keeps ingestion configs by (app_id, ingestion_config_id) for ttl seconds.
+
+    Expired entries are not dropped, their ETag is sent as If-None-Match and a 304 renews them without
+    transferring the config again. Callers get their own copy of the config.
+    """
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = {}
 
+    def get(self, key):
+        """Returns (config, etag), config is None unless the entry is still fresh."""
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is None:
+            return None, None
+        config, etag, fetched_at = entry
+        if time.monotonic() - fetched_at < self.ttl:
+            return copy.deepcopy(config), etag
+        return None, etag
 
-threading.Thread(target=lambda: every(1800, iterate_and_update_job_status), daemon=True).start()
+    def renew(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            self.entries[key] = (entry[0], entry[1], time.monotonic())
+        return copy.deepcopy(entry[0])
 
+    def put(self, key, config, etag):
+        with self.lock:
+            self.entries[key] = (copy.deepcopy(config), etag, time.monotonic())
 
-def get_ingestion_config(ingestion_config_id, app_id):
-    app_url = get_app_url()
-    url = f"https://{app_url}/app/{app_id}/ingestionConfig/{ingestion_config_id}"
-    headers = get_headers()
-    response = call_api("GET", url, headers=headers,
-                        verify=False if "svc.cluster.local" in app_url else True,
-                        is_internal=True)
-    
+    def invalidate(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+ingestion_config_cache = IngestionConfigCache()
+
+
+def get_ingestion_config_key(ingestion_config_id, app_id, config):
+    # Tenants of one process may use the same app and config ids, but not the same app service and credentials
+    return config.app_url, config.tenant_id or config.token, str(app_id), str(ingestion_config_id)
+
+
+def validate_ingestion_config(response):
+    if not response.get("config"):
+        raise KeyError("config  missing in the response.")
+    if not response["config"].get("_selectedScopeIds"):
+        raise KeyError("_selectedScopeIds are missing in the response.")
+
+
+def get_ingestion_config(ingestion_config_id, app_id, use_cache=True, config=None):
+    # use_cache=False always fetches the config, the fresh copy still replaces the cached one
+    config = config or get_config()
+    key = get_ingestion_config_key(ingestion_config_id, app_id, config)
+    ingestion_config, etag = ingestion_config_cache.get(key) if use_cache else (None, None)
+    if ingestion_config is not None:
+        return ingestion_config
+    url = f"https://{config.app_url}/app/{app_id}/ingestionConfig/{ingestion_config_id}"
+    headers = {"If-None-Match": etag} if etag else None
+    response = call_internal_api("GET", url, config, headers=headers, verify=config.verify_app,
+                                 new_status_validator=not_modified_validator)
+    if response.status_code == 304:
+        ingestion_config = ingestion_config_cache.renew(key)
+        if ingestion_config is not None:
+            return ingestion_config
+        # Patched while the request was in flight, fetch it again unconditionally
+        return get_ingestion_config(ingestion_config_id, app_id, use_cache=False, config=config)
+
+    ingestion_config = response.json()
+    validate_ingestion_config(ingestion_config)
+    ingestion_config_cache.put(key, ingestion_config, response.headers.get("ETag"))
+    return ingestion_config
+
+
+def patch_ingestion_config(ingestion_config_id, app_id, payload, config=None):
+    config = config or get_config()
+    url = f"https://{config.app_url}/app/{app_id}/ingestionConfig/{ingestion_config_id}"
     try:
-        response = response.json()
-        if not response.get("config"):
-            raise KeyError("config  missing in the response.")
-        else:
-            if not response["config"].get("_selectedScopeIds"):
-                raise KeyError("_selectedScopeIds are missing in the response.")            
-        return response
-    except:
-        raise
-
-def patch_ingestion_config(ingestion_config_id, app_id, payload):
-    app_url = get_app_url()
-    url = f"https://{app_url}/app/{app_id}/ingestionConfig/{ingestion_config_id}"
-    headers = get_headers()
-    response = call_api("PATCH", url=url, headers=headers, json=payload,
-                        verify=False if "svc.cluster.local" in app_url else True,
-                        is_internal=True)
+        response = call_internal_api("PATCH", url, config, json=payload, verify=config.verify_app)
+    finally:
+        ingestion_config_cache.invalidate(get_ingestion_config_key(ingestion_config_id, app_id, config))
     return response.text
 
-def get_access_token():
-    auth_url = get_auth_url()
+
+class AccessTokenCache:
+    """Keeps a client credentials token until shortly before it expires.
+
+    Callers within refresh_margin seconds of expiry keep using the current token while one of them refreshes it,
+    once the token has expired everyone waits for that single refresh.
+    """
+
+    def __init__(self, refresh_margin=120):
+        self.refresh_margin = refresh_margin
+        self.lock = threading.Lock()
+        self.access_token = None
+        self.expires_at = 0
+
+    def get(self, fetch_token):
+        access_token = self.peek()
+        if access_token:
+            return access_token
+        if self.access_token and time.time() < self.expires_at:
+            if not self.lock.acquire(blocking=False):
+                return self.access_token
+        else:
+            self.lock.acquire()
+        try:
+            if self.access_token and time.time() < self.expires_at - self.refresh_margin:
+                return self.access_token
+            response = fetch_token()
+            self.access_token = response["access_token"]
+            self.expires_at = time.time() + float(response.get("expires_in", 0))
+            return self.access_token
+        finally:
+            self.lock.release()
+
+    def peek(self):
+        """Returns the cached token when it does not need a refresh yet, None otherwise."""
+        if self.access_token and time.time() < self.expires_at - self.refresh_margin:
+            return self.access_token
+        return None
+
+    def invalidate(self, access_token=None):
+        """Drops the cached token, with access_token only if that is still the cached one."""
+        with self.lock:
+            if access_token is None or access_token == self.access_token:
+                self.access_token = None
+                self.expires_at = 0
+
+
+access_token_caches = {}
+access_token_caches_lock = threading.Lock()
+
+
+def fetch_access_token(auth_url, client_id, client_secret, verify=None):
     url = f"{auth_url}/oauth/token"
     data = {
         "grant_type": "client_credentials",
-        "client_id": get_client_id(),
-        "client_secret": get_client_secret(),
+        "client_id": client_id,
+        "client_secret": client_secret,
     }
-    response = call_api("POST", url, data=data, verify=False if "svc.cluster.local" in auth_url else True,
-                        is_internal=True)
-    return response.json()["access_token"]
+    if verify is None:
+        verify = False if "svc.cluster.local" in auth_url else True
+    response = call_api("POST", url, data=data, verify=verify, is_internal=True)
+    return response.json()
+
+
+def get_access_token_cache(auth_url, client_id):
+    with access_token_caches_lock:
+        return access_token_caches.setdefault((auth_url, client_id), AccessTokenCache())
+
+
+def get_access_token(config=None):
+    config = config or get_config()
+    client_id = config.require("client_id")
+    client_secret = config.require("client_secret")
+    return get_access_token_cache(config.auth_url, client_id).get(
+        lambda: fetch_access_token(config.auth_url, client_id, client_secret, config.verify_auth))
+
+
+def invalidate_access_token(config=None, access_token=None):
+    config = config or get_config()
+    get_access_token_cache(config.auth_url, config.require("client_id")).invalidate(access_token)
+
+
+def get_stage_credential_keys(stage_details):
+    # What initialize_client needs to create the storage client of a stage
+    if stage_details.get("cloud") == "aws":
+        return "accessKey", "secretKey"
+    if stage_details.get("cloud") == "gcp" and "bucket" in stage_details:
+        return ("serviceAccountCredentialsJson",)
+    return ()
+
+
+class Chunk:
+    def __init__(self, file_path):
+        self.file = None
+        # Compressed output goes to exactly one of sink_file, upload_stream or chunk_buffer, None for plain chunks
+        self.sink_file = None
+        self.upload_stream = None
+        self.chunk_buffer = None
+        self.lock = threading.Lock()
+        self.reset(file_path)
+
+    def reset(self, file_path):
+        self.file_path = file_path
+        self.bytes_written = 0
+        self.records = 0
+        self.first_write_ts = None
+
+    def compressed_bytes(self):
+        sink = self.sink_file or self.upload_stream or self.chunk_buffer
+        if sink is not None:
+            return sink.tell()
+        return self.bytes_written
+
+    def flush(self):
+        self.file.flush()
+        if self.sink_file is not None:
+            self.sink_file.flush()
+
+    def close_file(self):
+        self.file.close()
+        if self.sink_file is not None:
+            self.sink_file.close()
+            self.sink_file = None
+
 
 class DassanaWriter:
     def __init__(self, source, record_type, config_id, metadata=None, priority=None, is_snapshot=False,
-                 file_size_limit=249):
+                 file_size_limit=249, stream_compression=False, rotate_on_compressed_size=False, upload_workers=0,
+                 max_pending_uploads=None, encoder="ujson", multipart_part_size=64, multipart_concurrency=4,
+                 stream_upload=False, buffer_in_memory=False, memory_buffer_limit=256, shards=1,
+                 rotation_policy=None, spool_dir=None, compression="gzip", compression_level=None,
+                 compression_threads=1, retry_budget=None, attach_metrics=False, config=None, resume_job_id=None,
+                 exact_decimals=False):
         if metadata is None:
             metadata = {}
         logger.info("Initialized common utility")
 
         self.file_size_limit = file_size_limit
+        # stream_upload sends the compressed chunk to S3 as a multipart upload while it is being written,
+        # the chunk never exists as a finished file. Only available for internal auth with an AWS stage.
+        self.stream_upload = stream_upload
+        # buffer_in_memory keeps the compressed chunk in a memory buffer that only spills to a temporary file once
+        # it grows past memory_buffer_limit (MB), chunks are uploaded from the buffer without touching the CWD.
+        self.buffer_in_memory = buffer_in_memory
+        self.memory_buffer_limit = memory_buffer_limit
+        self.stream_compression = stream_compression or stream_upload or buffer_in_memory
+        # gzip defaults to level 9, compression_threads > 1 compresses gzip blocks in parallel into a single
+        # gzip stream. zstd needs the zstandard package and an ingestion service accepting .zst chunks.
+        self.codec = get_codec(compression, compression_level, compression_threads)
+        self.multipart_part_size = int(multipart_part_size * 1024 * 1024)
+        self.multipart_concurrency = multipart_concurrency
+        # file_size_limit always applies, rotation_policy can add record count and age limits on top of it
+        self.rotation_policy = MaxSizePolicy(file_size_limit,
+                                             compressed=self.stream_compression and rotate_on_compressed_size)
+        if rotation_policy is not None:
+            self.rotation_policy = self.rotation_policy | rotation_policy
+        self.rotation_stop = threading.Event()
+        self.rotation_thread = None
+        self.rotation_failure = None
+        # Decimal values are written as JSON numbers, exact_decimals writes their exact string instead
+        self.encoder = get_encoder(encoder, exact_decimals)
+        # Counts the retries and backoff time of the job's own control plane calls, pass the same budget to call_api
+        # for the source API to cap the retries of the whole job
+        self.retry_budget = retry_budget or RetryBudget()
+        # attach_metrics adds the call_api metrics recorded while the job ran to the job result sent on close. Calls
+        # other jobs of the process make at the same time are counted as well.
+        self.attach_metrics = attach_metrics
+        self.metrics_scope = metrics.start_scope() if attach_metrics else None
+        # With upload_workers > 0 rotated chunks are compressed and uploaded by a background pool while the
+        # caller keeps writing. max_pending_uploads bounds how many chunks may wait on disk at once.
+        self.upload_executor = None
+        self.upload_slots = None
+        self.pending_uploads = []
+        self.upload_lock = threading.Lock()
+        if upload_workers:
+            self.upload_executor = ThreadPoolExecutor(max_workers=upload_workers,
+                                                      thread_name_prefix="dassana-upload")
+            self.upload_slots = threading.BoundedSemaphore(max_pending_uploads or upload_workers)
+        self.aws_client_lock = threading.Lock()
         self.source = source
         self.record_type = record_type
         self.config_id = config_id
         self.metadata = metadata
         self.priority = priority
         self.is_snapshot = is_snapshot
-        self.bytes_written = 0
+        # Records are spread over shards independent chunks, each with its own lock and compressor, so several
+        # producer threads can write to the same job without waiting on each other.
+        self.shard_count = max(1, int(shards))
+        self.shard_counter = itertools.count()
+        self.shards = []
         self.fail_counter = 0
         self.pass_counter = 0
         self.debug_log = set()
@@ -150,25 +391,94 @@ class DassanaWriter:
         self.bucket_name = None
         self.blob = None
         self.full_file_path = None
-        self.ingestion_service_url = get_ingestion_srv_url()
-        self.is_internal_auth = is_internal_auth()
-        self.file_path = self.get_file_path()
+        # The tenant settings of the job, the config of the process unless the writer is given its own
+        self.config = config or get_config()
+        self.ingestion_service_url = self.config.ingestion_service_url
+        self.is_internal_auth = self.config.is_internal_auth
         self.job_id = None
         self.ingestion_metadata = None
         self.custom_file_dict = dict()
+        self.custom_file_lock = threading.Lock()
+        # With a spool_dir chunks are written there together with a manifest of the job, a writer restarted after
+        # a crash resumes the job and uploads the chunks that were left behind. checkpoint is restored on resume
+        # so the connector can continue collecting where it stopped. resume_job_id picks the job to resume, otherwise
+        # any job of the same source, record type and config id whose writer is gone is resumed.
+        self.spool_dir = spool_dir
+        self.resume_job_id = resume_job_id
+        self.spool = None
+        self.resumed = False
+        self.checkpoint = None
+        if self.spool_dir and (self.stream_upload or self.buffer_in_memory):
+            raise ValueError("spool_dir requires chunks written to disk")
+        if self.spool_dir and self.codec.extension != ".gz":
+            raise ValueError("spool_dir only supports gzip compression")
+        # Settings are checked before the job is created, only the stage type has to wait for the job
+        if self.stream_upload and not self.is_internal_auth:
+            raise ValueError("stream_upload is only supported for AWS stages")
         self.initialize_client()
-        log(scope_id=self.metadata["scope"]["scopeId"], job_id=self.job_id)
-        self.file = open(self.file_path, 'a')
+        if self.stream_upload and self.storage_service != 'aws':
+            self.cancel_job_with_error_info("internal_error", "stream_upload is only supported for AWS stages")
+            raise ValueError("stream_upload is only supported for AWS stages")
+        # The job exists and heartbeats from here on, a writer failing to start cancels it instead of leaving it open
+        try:
+            log(scope_id=self.metadata["scope"]["scopeId"], job_id=self.job_id, config=self.config)
+            if self.resumed:
+                self.upload_spooled_chunks()
+            for _ in range(self.shard_count):
+                self.shards.append(self.open_chunk())
+            rotation_check_interval = self.rotation_policy.check_interval()
+            if rotation_check_interval:
+                self.rotation_thread = threading.Thread(target=self.rotate_idle_chunks,
+                                                        args=(rotation_check_interval,), daemon=True)
+                self.rotation_thread.start()
+        except Exception as exp:
+            self.cancel_job(exp)
+            raise
+
+    @property
+    def bytes_written(self):
+        return sum(chunk.bytes_written for chunk in self.shards)
 
     def get_file_path(self):
-        epoch_ts = int(time.time())
+        # Chunk names must stay unique across rotations in the same second, shards and writers in one process
+        file_name = f"{int(time.time())}-{uuid4().hex}.ndjson"
+        if self.spool is not None:
+            return self.spool.chunk_path(file_name)
         if not self.is_internal_auth:
-            return f"/tmp/{epoch_ts}.ndjson"
-        return f"{epoch_ts}.ndjson"
+            return f"/tmp/{file_name}"
+        return file_name
+
+    def open_chunk(self):
+        chunk = Chunk(self.get_file_path())
+        chunk.file = self.open_file(chunk)
+        return chunk
+
+    def open_file(self, chunk):
+        if self.stream_upload:
+            chunk.upload_stream = S3MultipartWriter(self.get_aws_client, self.bucket_name,
+                                                    self.get_object_key(chunk.file_path),
+                                                    part_size=self.multipart_part_size,
+                                                    concurrency=self.multipart_concurrency)
+            return self.codec.open(chunk.upload_stream)
+        if self.buffer_in_memory:
+            chunk.chunk_buffer = tempfile.SpooledTemporaryFile(
+                max_size=int(self.memory_buffer_limit) * 1000 * 1000, suffix=f".ndjson{self.codec.extension}")
+            return self.codec.open(chunk.chunk_buffer)
+        if self.spool is not None:
+            self.spool.add_chunk(chunk.file_path, self.stream_compression)
+        # In stream compression mode records are gzipped as they are written, so the
+        # chunk never exists uncompressed on disk and compress_file is not needed.
+        if self.stream_compression:
+            chunk.sink_file = open(f"{chunk.file_path}{self.codec.extension}", 'wb')
+            return self.codec.open(chunk.sink_file)
+        return open(chunk.file_path, 'wb')
 
     def initialize_client(self):
-        global job_list
-        response = self.get_ingestion_details()
+        response = None
+        if self.spool_dir:
+            response = self.resume_spooled_job()
+        if response is None:
+            response = self.get_ingestion_details()
         if "jobId" not in response or "stageDetails" not in response or "cloud" not in response["stageDetails"]:
             raise InternalError("Invalid job created with missing details")
 
@@ -183,122 +493,408 @@ class DassanaWriter:
             self.ingestion_metadata["creationTs"] = response["creationTs"]
         else:
             self.ingestion_metadata["creationTs"] = int(time.time() * 1000)
-        job_list.add(self.job_id)
+        heartbeat_manager.register(self.job_id, self.config)
+        try:
+            if self.spool_dir and self.spool is None:
+                self.spool = JobSpool.create(self.spool_dir, self.source, self.record_type, self.config_id, response)
 
-        if "bucket" in response['stageDetails']:
-            self.bucket_name = response['stageDetails']['bucket']
-            self.full_file_path = response['stageDetails']['filePath']
+            if "bucket" in response['stageDetails']:
+                self.bucket_name = response['stageDetails']['bucket']
+                self.full_file_path = response['stageDetails']['filePath']
 
-        if self.storage_service == 'gcp':
-            if "bucket" in response["stageDetails"]:
-                credentials = response['stageDetails']['serviceAccountCredentialsJson']
-                with open('service_account.json', 'w') as f:
-                    json.dump(json.loads(credentials), f, indent=4)
-                    f.close()
+            if self.storage_service == 'gcp':
+                if "bucket" in response["stageDetails"]:
+                    credentials = response['stageDetails']['serviceAccountCredentialsJson']
+                    with open('service_account.json', 'w') as f:
+                        json.dump(json.loads(credentials), f, indent=4)
+                        f.close()
 
-                os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = 'service_account.json'
-                self.client = storage.Client()
-        elif self.storage_service == 'aws':
-            stage_details = response['stageDetails']
-            if "awsIamRoleArn" in stage_details and stage_details["awsIamRoleArn"] is not None:
-                self.aws_sts_client = boto3.client('sts', aws_access_key_id=stage_details['accessKey'],
-                                                   aws_secret_access_key=stage_details['secretKey'])
-                self.aws_iam_role_arn = stage_details['awsIamRoleArn']
-                self.aws_iam_external_id = stage_details['awsIamExternalId']
-            else:
-                self.client = boto3.client('s3', aws_access_key_id=stage_details['accessKey'],
-                                           aws_secret_access_key=stage_details['secretKey'])
+                    os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = 'service_account.json'
+                    # Cloud SDKs are imported with the first stage that needs them, they dominate the import time
+                    from google.cloud import storage
+                    self.client = storage.Client()
+            elif self.storage_service == 'aws':
+                import boto3
+                stage_details = response['stageDetails']
+                if "awsIamRoleArn" in stage_details and stage_details["awsIamRoleArn"] is not None:
+                    self.aws_sts_client = boto3.client('sts', aws_access_key_id=stage_details['accessKey'],
+                                                       aws_secret_access_key=stage_details['secretKey'])
+                    self.aws_iam_role_arn = stage_details['awsIamRoleArn']
+                    self.aws_iam_external_id = stage_details['awsIamExternalId']
+                else:
+                    self.client = boto3.client('s3', aws_access_key_id=stage_details['accessKey'],
+                                               aws_secret_access_key=stage_details['secretKey'],
+                                               endpoint_url=self.config.s3_endpoint_url)
+        except Exception as exp:
+            self.cancel_job(exp)
+            raise
+
+    def serialize(self, json_object):
+        return self.encoder(json_object)
 
     def write_json(self, json_object):
-        self.file.flush()
-        json.dump(json_object, self.file)
-        self.file.write('\n')
-        self.bytes_written = self.file.tell()
-        if self.bytes_written >= int(self.file_size_limit) * 1000 * 1000:
-            self.file.close()
-            compress_file(self.file_path)
-            self.upload_to_cloud(self.file_path)
-            self.file_path = self.get_file_path()
-            self.file = open(self.file_path, 'a')
-            logger.info(f"Ingested data: {self.bytes_written} bytes")
-            self.bytes_written = 0
+        self.write_lines([self.serialize(json_object)])
 
-    def write_custom_json(self, json_object, file_name):
-        if file_name in self.custom_file_dict:
-            custom_file = self.custom_file_dict[file_name]
+    def write_many(self, json_objects, batch_size=1000 * 1000):
+        return self.write_iter(json_objects, batch_size)
+
+    def write_iter(self, json_objects, batch_size=1000 * 1000):
+        # Records are serialized into an in-memory batch of roughly batch_size bytes and written with a
+        # single call, byte accounting never touches the file.
+        batch = []
+        batch_bytes = 0
+        count = 0
+        for json_object in json_objects:
+            data = self.serialize(json_object)
+            batch.append(data)
+            batch_bytes += len(data)
+            count += 1
+            if batch_bytes >= batch_size:
+                self.write_lines(batch)
+                batch = []
+                batch_bytes = 0
+        if batch:
+            self.write_lines(batch)
+        return count
+
+    def write_pages(self, method, url, paginator, **kwargs):
+        """Writes every record of a paginated listing, the next pages are fetched while the current one is written."""
+        return self.write_iter(paginate(method, url, paginator, **kwargs))
+
+    def write_lines(self, lines):
+        # The batch is cut where the chunk fills up according to the rotation policy so rotation still
+        # happens on a record boundary.
+        if self.rotation_failure is not None:
+            raise self.rotation_failure
+        chunk = self.acquire_chunk()
+        try:
+            bytes_left, records_left = self.rotation_policy.remaining(chunk)
+            pending = []
+            pending_bytes = 0
+            for line in lines:
+                pending.append(line)
+                pending_bytes += len(line)
+                if (bytes_left is not None and pending_bytes >= bytes_left) or (
+                        records_left is not None and len(pending) >= records_left):
+                    self.write_batch(chunk, b''.join(pending), len(pending))
+                    pending = []
+                    pending_bytes = 0
+                    bytes_left, records_left = self.rotation_policy.remaining(chunk)
+            if pending:
+                self.write_batch(chunk, b''.join(pending), len(pending))
+        finally:
+            chunk.lock.release()
+
+    def acquire_chunk(self):
+        start = next(self.shard_counter)
+        for i in range(self.shard_count):
+            chunk = self.shards[(start + i) % self.shard_count]
+            if chunk.lock.acquire(blocking=False):
+                return chunk
+        chunk = self.shards[start % self.shard_count]
+        chunk.lock.acquire()
+        return chunk
+
+    def write_batch(self, chunk, data, records=1):
+        chunk.file.write(data)
+        chunk.bytes_written += len(data)
+        chunk.records += records
+        if chunk.first_write_ts is None:
+            chunk.first_write_ts = time.time()
+        if self.rotation_policy.should_rotate(chunk):
+            self.rotate_chunk(chunk)
+
+    def resume_spooled_job(self):
+        spool = JobSpool.find(self.spool_dir, self.source, self.record_type, self.config_id, self.resume_job_id)
+        if spool is None:
+            return None
+        try:
+            # The spool keeps no credentials, the stage details of the job come from the ingestion service again
+            response = patch_ingestion(spool.job_id, config=self.config)
+            stage_details = {**spool.job["stageDetails"], **response.get("stageDetails", {})}
+            missing = [key for key in get_stage_credential_keys(stage_details) if not stage_details.get(key)]
+            if missing:
+                raise InternalError(f"Stage credentials {', '.join(missing)} were not returned")
+        except Exception as exp:
+            logger.warning(f"Discarding spooled job {spool.job_id}, it can not be resumed due to {exp}")
+            spool.remove(remove_chunks=True)
+            return None
+        logger.info(f"Resuming spooled job {spool.job_id} with {len(spool.chunks())} chunks left to upload")
+        self.spool = spool
+        self.resumed = True
+        self.checkpoint = spool.checkpoint
+        return {**spool.job, "stageDetails": stage_details}
+
+    def upload_spooled_chunks(self):
+        for file_path, chunk_state in self.spool.chunks().items():
+            compressed = chunk_state["compressed"]
+            if chunk_state["status"] == "open" and not recover_chunk(file_path, compressed):
+                self.spool.remove_chunk(file_path)
+                for file_name in (file_path, f"{file_path}{self.codec.extension}"):
+                    if os.path.exists(file_name):
+                        os.remove(file_name)
+                continue
+            self.spool.close_chunk(file_path)
+            self.submit_upload(file_path, lambda name, compressed=compressed: self.upload_spooled_chunk(name, compressed))
+
+    def upload_spooled_chunk(self, file_name, compressed):
+        if not compressed:
+            compress_file(file_name, self.codec)
+        self.upload_to_cloud(file_name)
+        self.spool.remove_chunk(file_name)
+
+    def save_checkpoint(self, checkpoint):
+        """Persists a connector checkpoint with the spool, records written before the call survive a crash."""
+        if self.spool is None:
+            raise ValueError("save_checkpoint requires spool_dir")
+        for chunk in self.shards:
+            with chunk.lock:
+                chunk.flush()
+        self.spool.set_checkpoint(checkpoint)
+        self.checkpoint = checkpoint
+
+    def rotate_chunk(self, chunk):
+        chunk.close_file()
+        self.submit_chunk(chunk)
+        logger.info(f"Ingested data: {chunk.records} records, {chunk.bytes_written} bytes")
+        chunk.reset(self.get_file_path())
+        chunk.file = self.open_file(chunk)
+
+    def rotate_idle_chunks(self, interval):
+        # Age based rotation has to happen even when the source is not producing records
+        while not self.rotation_stop.wait(interval):
+            for chunk in self.shards:
+                with chunk.lock:
+                    if not chunk.records or not self.rotation_policy.should_rotate(chunk):
+                        continue
+                    try:
+                        self.rotate_chunk(chunk)
+                    except Exception as exp:
+                        logger.error(f"Failed to rotate chunk {chunk.file_path} due to {exp}")
+                        self.rotation_failure = exp
+                        return
+
+    def end_metrics_scope(self):
+        if self.metrics_scope is not None:
+            metrics.end_scope(self.metrics_scope)
+
+    def stop_rotation(self):
+        # A rotation pass still running could otherwise submit a chunk that close is submitting as well
+        self.rotation_stop.set()
+        if self.rotation_thread is not None and self.rotation_thread is not threading.current_thread():
+            self.rotation_thread.join()
+
+    def submit_chunk(self, chunk):
+        stream = chunk.upload_stream
+        chunk_buffer = chunk.chunk_buffer
+        chunk.upload_stream = None
+        chunk.chunk_buffer = None
+        if stream is not None:
+            self.submit_upload(chunk.file_path, lambda _: self.complete_upload_stream(stream))
+        elif chunk_buffer is not None:
+            self.submit_upload(chunk.file_path, lambda name: self.upload_chunk_buffer(name, chunk_buffer))
+        elif self.spool is not None:
+            self.spool.close_chunk(chunk.file_path)
+            self.submit_upload(chunk.file_path,
+                               lambda name: self.upload_spooled_chunk(name, self.stream_compression))
         else:
-            custom_file = open(file_name, 'a')
-            self.custom_file_dict[file_name] = custom_file
-        custom_file.flush()
-        json.dump(json_object, custom_file)
-        custom_file.write('\n')
+            self.submit_upload(chunk.file_path)
 
-    def upload_to_cloud(self, file_name):
+    def upload_chunk_buffer(self, file_name, chunk_buffer):
         try:
-            if not self.is_internal_auth:
-                self.upload_to_signed_url()
-            elif self.storage_service == 'gcp':
-                self.upload_to_gcp(file_name)
-            elif self.storage_service == 'aws':
-                self.upload_to_aws(file_name)
+            chunk_buffer.seek(0)
+            self.upload_to_cloud(file_name, chunk_buffer)
+        finally:
+            chunk_buffer.close()
+
+    def complete_upload_stream(self, stream):
+        try:
+            stream.close()
+        except Exception as exp:
+            raise StageWriteFailure(str(exp))
+
+    def upload_chunk(self, file_name):
+        if not self.stream_compression:
+            compress_file(file_name, self.codec)
+        self.upload_to_cloud(file_name)
+
+    def submit_upload(self, file_name, upload=None):
+        upload = upload or self.upload_chunk
+        if self.upload_executor is None:
+            upload(file_name)
+            return
+        self.raise_failed_uploads()
+        self.upload_slots.acquire()
+        try:
+            future = self.upload_executor.submit(upload, file_name)
+        except Exception:
+            self.upload_slots.release()
+            raise
+        future.add_done_callback(lambda _: self.upload_slots.release())
+        with self.upload_lock:
+            self.pending_uploads.append(future)
+
+    def upload_custom_file(self, file_name):
+        compress_file(file_name, self.codec)
+        self.upload_to_cloud(file_name)
+
+    def raise_failed_uploads(self, wait=False):
+        failure = None
+        with self.upload_lock:
+            futures = self.pending_uploads
+            self.pending_uploads = [future for future in futures if not wait and not future.done()]
+        for future in futures:
+            if not wait and not future.done():
+                continue
+            exp = future.exception()
+            if exp is not None and failure is None:
+                failure = exp if isinstance(exp, StageWriteFailure) else StageWriteFailure(str(exp))
+        if failure is not None:
+            raise failure
+
+    def wait_for_uploads(self):
+        if self.upload_executor is None:
+            return
+        try:
+            self.raise_failed_uploads(wait=True)
+        finally:
+            self.upload_executor.shutdown(wait=True)
+
+    def discard_chunk(self, chunk):
+        try:
+            chunk.close_file()
+        except Exception as exp:
+            logger.warning(f"Failed to close chunk {chunk.file_path} due to {exp}")
+        if chunk.upload_stream is not None:
+            chunk.upload_stream.abort()
+            chunk.upload_stream = None
+        if chunk.chunk_buffer is not None:
+            chunk.chunk_buffer.close()
+            chunk.chunk_buffer = None
+        for file_name in (chunk.file_path, f"{chunk.file_path}{self.codec.extension}"):
+            if os.path.exists(file_name):
+                os.remove(file_name)
+        if self.spool is not None:
+            self.spool.remove_chunk(chunk.file_path)
+
+    def remove_spool(self):
+        if self.spool is not None:
+            self.spool.remove(remove_chunks=True)
+            self.spool = None
+
+    def abort_uploads(self):
+        self.stop_rotation()
+        for chunk in self.shards:
+            self.discard_chunk(chunk)
+        if self.upload_executor is None:
+            return
+        self.upload_executor.shutdown(wait=False, cancel_futures=True)
+        self.pending_uploads = []
+
+    def write_custom_json(self, json_object, file_name):
+        with self.custom_file_lock:
+            if file_name in self.custom_file_dict:
+                custom_file = self.custom_file_dict[file_name]
+            else:
+                custom_file = open(file_name, 'ab')
+                self.custom_file_dict[file_name] = custom_file
+            custom_file.write(self.encoder(json_object))
+
+    def upload_to_cloud(self, file_name, fileobj=None):
+        try:
+            if fileobj is None:
+                with open(f"{file_name}{self.codec.extension}", 'rb') as chunk_file:
+                    self.upload_fileobj(file_name, chunk_file)
             else:
-                raise StageWriteFailure("Unsupported stage")
+                self.upload_fileobj(file_name, fileobj)
         except Exception as exp:
             raise StageWriteFailure(str(exp))
 
         if os.path.exists(file_name):
             os.remove(file_name)
-        if os.path.exists(file_name + ".gz"):
-            os.remove(file_name + ".gz")
+        if os.path.exists(file_name + self.codec.extension):
+            os.remove(file_name + self.codec.extension)
 
-    def upload_to_gcp(self, file_name):
+    def upload_fileobj(self, file_name, fileobj):
+        if not self.is_internal_auth:
+            self.upload_to_signed_url(fileobj)
+        elif self.storage_service == 'gcp':
+            self.upload_to_gcp(file_name, fileobj)
+        elif self.storage_service == 'aws':
+            self.upload_to_aws(file_name, fileobj)
+        else:
+            raise StageWriteFailure("Unsupported stage")
+
+    def upload_to_gcp(self, file_name, fileobj):
         if self.client is None:
             raise ValueError("GCP client not initialized.")
 
-        self.blob = self.client.bucket(self.bucket_name).blob(str(self.full_file_path) + "/" + str(file_name) + ".gz")
-        self.blob.upload_from_filename(file_name + ".gz")
+        blob = self.client.bucket(self.bucket_name).blob(self.get_object_key(file_name))
+        self.blob = blob
+        blob.upload_from_file(fileobj)
 
-    def upload_to_aws(self, file_name):
+    def get_aws_client(self):
         if self.client is None and self.aws_sts_client is None:
             raise ValueError("AWS client not initialized")
 
-        if self.aws_iam_role_arn and (not self.aws_session_token_expiration or (
-                self.aws_session_token_expiration.timestamp() < (
-                datetime.datetime.now() + datetime.timedelta(minutes=2)).timestamp())):
-            assume_role_response = self.aws_sts_client.assume_role(
-                RoleArn=self.aws_iam_role_arn,
-                RoleSessionName="DassanaIngestion",
-                ExternalId=self.aws_iam_external_id)
-            temp_credentials = assume_role_response['Credentials']
-            self.aws_session_token_expiration = temp_credentials['Expiration']
-            self.client = boto3.client(
-                's3',
-                aws_access_key_id=temp_credentials['AccessKeyId'],
-                aws_secret_access_key=temp_credentials['SecretAccessKey'],
-                aws_session_token=temp_credentials['SessionToken'])
-
-        self.client.put_object(Body=open(f"{file_name}.gz", 'rb'), Bucket=self.bucket_name,
-                               Key=f"{str(self.full_file_path)}/{str(file_name)}.gz")
-
-    def upload_to_signed_url(self):
+        # Uploads may run on several worker threads, only one of them should refresh the assumed role.
+        with self.aws_client_lock:
+            if self.aws_iam_role_arn and (not self.aws_session_token_expiration or (
+                    self.aws_session_token_expiration.timestamp() < (
+                    datetime.datetime.now() + datetime.timedelta(minutes=2)).timestamp())):
+                assume_role_response = self.aws_sts_client.assume_role(
+                    RoleArn=self.aws_iam_role_arn,
+                    RoleSessionName="DassanaIngestion",
+                    ExternalId=self.aws_iam_external_id)
+                temp_credentials = assume_role_response['Credentials']
+                self.aws_session_token_expiration = temp_credentials['Expiration']
+                import boto3
+                self.client = boto3.client(
+                    's3',
+                    aws_access_key_id=temp_credentials['AccessKeyId'],
+                    aws_secret_access_key=temp_credentials['SecretAccessKey'],
+                    aws_session_token=temp_credentials['SessionToken'],
+                    endpoint_url=self.config.s3_endpoint_url)
+            return self.client
+
+    def get_object_key(self, file_name):
+        file_name = str(file_name)
+        # Spooled chunks are keyed by their name alone, other files like custom ones keep the path they were given
+        if self.spool_dir:
+            spool_prefix = os.path.join(self.spool_dir, "")
+            if file_name.startswith(spool_prefix):
+                file_name = file_name[len(spool_prefix):]
+        return f"{str(self.full_file_path)}/{file_name}{self.codec.extension}"
+
+    def upload_to_aws(self, file_name, fileobj):
+        from boto3.s3.transfer import TransferConfig
+        client = self.get_aws_client()
+        # upload_fileobj switches to a parallel multipart upload above the part size, a failed part is retried
+        # on its own instead of re-sending the whole chunk
+        transfer_config = TransferConfig(multipart_threshold=self.multipart_part_size,
+                                         multipart_chunksize=self.multipart_part_size,
+                                         max_concurrency=self.multipart_concurrency)
+        client.upload_fileobj(fileobj, self.bucket_name, self.get_object_key(file_name), Config=transfer_config)
+
+    def upload_to_signed_url(self, fileobj):
         signed_url = self.get_signing_url()
         if not signed_url:
             raise ValueError("The signed URL has not been received")
 
         headers = {
-            'Content-Encoding': 'gzip',
+            'Content-Encoding': self.codec.content_encoding,
             'Content-Type': 'application/octet-stream'
         }
-        with open(str(self.file_path) + ".gz", "rb") as read:
-            data = read.read()
-            requests.put(url=signed_url, data=data, headers=headers, verify=False if "svc.cluster.local" in signed_url else True)
-            
+        send_request("PUT", signed_url, data=fileobj.read(), headers=headers,
+                     verify=self.config.get_verify(signed_url))
+
     def cancel_job_with_error_info(self, error_code, failure_reason, fail_type="failed", error_message=None, is_internal=True, is_auto_recoverable=False):
         if not error_message:
             error_message = "Unexpected error occurred while collecting data"
 
-        global job_list
-        job_list.discard(self.job_id)
+        heartbeat_manager.unregister(self.job_id)
+        self.end_metrics_scope()
+        self.abort_uploads()
         if os.path.exists("service_account.json"):
             os.remove("service_account.json")
         metadata = {}
@@ -313,11 +909,14 @@ class DassanaWriter:
                       "is_auto_recoverable": is_auto_recoverable}
         metadata["job_result"] = job_result
         self.cancel_ingestion_job(metadata, fail_type)
-        log(status=fail_type, scope_id=self.metadata["scope"]["scopeId"], metadata=job_result)
+        self.remove_spool()
+        log(status=fail_type, scope_id=self.metadata["scope"]["scopeId"], metadata=job_result, config=self.config)
+        flush_logs()
 
     def cancel_job(self, exception_from_src):
-        global job_list
-        job_list.discard(self.job_id)
+        heartbeat_manager.unregister(self.job_id)
+        self.end_metrics_scope()
+        self.abort_uploads()
         if os.path.exists("service_account.json"):
             os.remove("service_account.json")
         str_exc = get_exc_str(str(exception_from_src))
@@ -345,39 +944,59 @@ class DassanaWriter:
             job_result_metadata["is_auto_recoverable"] = False
 
         metadata = {"job_result": job_result_metadata}
-        self.cancel_ingestion_job(metadata, "failed") 
-        log(status=job_result_metadata["status"], scope_id=self.metadata["scope"]["scopeId"], exception=exception_from_src, metadata=job_result_metadata)
+        self.cancel_ingestion_job(metadata, "failed")
+        self.remove_spool()
+        log(status=job_result_metadata["status"], scope_id=self.metadata["scope"]["scopeId"], exception=exception_from_src, metadata=job_result_metadata,
+            config=self.config)
+        flush_logs()
 
     def close(self, metadata=None):
         if metadata is None:
             metadata = {}
-        global job_list
-        job_list.discard(self.job_id)
-        self.file.close()
+        self.stop_rotation()
+        if self.rotation_failure is not None:
+            # The records of the failed chunk are lost, the job must not be reported as complete or left running
+            self.cancel_job(self.rotation_failure)
+            raise self.rotation_failure
+        heartbeat_manager.unregister(self.job_id)
         job_result = {"status": "ready_for_loading",
                       "source": {"pass": int(self.pass_counter), "fail": int(self.fail_counter),
                                  "debug_log": list(self.debug_log)}}
         metadata["job_result"] = job_result
-        if self.bytes_written > 0:
-            compress_file(self.file_path)
-            self.upload_to_cloud(self.file_path)
-            logger.info(f"Ingested remaining data: {self.bytes_written} bytes")
-            self.bytes_written = 0
+        for chunk in self.shards:
+            with chunk.lock:
+                if chunk.bytes_written > 0:
+                    chunk.close_file()
+                    self.submit_chunk(chunk)
+                    logger.info(f"Ingested remaining data: {chunk.bytes_written} bytes")
+                    chunk.reset(chunk.file_path)
+                else:
+                    self.discard_chunk(chunk)
         for custom_file in self.custom_file_dict:
             self.custom_file_dict[custom_file].close()
-            compress_file(custom_file)
-            self.upload_to_cloud(custom_file)
+            self.submit_upload(custom_file, self.upload_custom_file)
+        self.wait_for_uploads()
         if os.path.exists("service_account.json"):
             os.remove("service_account.json")
+        if self.metrics_scope is not None:
+            job_result["api_metrics"] = metrics.end_scope(self.metrics_scope).to_json()
         self.update_ingestion_to_done(metadata)
-        log(status=job_result["status"], scope_id=self.metadata["scope"]["scopeId"],  metadata=job_result,job_id=self.job_id)
+        self.remove_spool()
+        retry_stats = self.retry_budget.snapshot()
+        if retry_stats["retries"]:
+            logger.info(f"Job spent {retry_stats['sleep_time']}s in {retry_stats['retries']} API retries")
+        log(status=job_result["status"], scope_id=self.metadata["scope"]["scopeId"],  metadata=job_result,job_id=self.job_id,
+            config=self.config)
+        # The job status event must not be lost when the process exits right after close
+        flush_logs()
 
     def update_ingestion_to_done(self, metadata):
         json_body = {
             "metadata": metadata
         }
-        res = call_api("POST", self.ingestion_service_url + "/job/" + self.job_id + "/" + "done", headers=get_headers(),
-                       json=json_body, is_internal=True, verify=False if "svc.cluster.local" in self.ingestion_service_url else True)
+        res = call_internal_api("POST", self.ingestion_service_url + "/job/" + self.job_id + "/" + "done",
+                                self.config, json=json_body, verify=self.config.verify_ingestion,
+                                retry_budget=self.retry_budget)
         logger.debug(f"Response Status: {res.status_code}")
         logger.debug(f"Request Body: {res.request.body}")
         logger.debug(f"Response Body: {res.text}")
@@ -395,23 +1014,24 @@ class DassanaWriter:
         if json_body["priority"] is None:
             del json_body["priority"]
 
-        res = call_api("POST", self.ingestion_service_url + "/job/", headers=get_headers(), json=json_body,
-                       is_internal=True, verify=False if "svc.cluster.local" in self.ingestion_service_url else True,)
+        res = call_internal_api("POST", self.ingestion_service_url + "/job/", self.config, json=json_body,
+                                verify=self.config.verify_ingestion, retry_budget=self.retry_budget)
         return res.json()
 
     def cancel_ingestion_job(self, metadata, fail_type):
         json_body = {
             "metadata": metadata
         }
-        res = call_api("POST", self.ingestion_service_url + "/job/" + self.job_id + "/" + fail_type,
-                       headers=get_headers(), json=json_body, is_internal=True, verify=False if "svc.cluster.local" in self.ingestion_service_url else True)
+        res = call_internal_api("POST", self.ingestion_service_url + "/job/" + self.job_id + "/" + fail_type,
+                                self.config, json=json_body, verify=self.config.verify_ingestion,
+                                retry_budget=self.retry_budget)
         logger.debug(f"Response Status: {res.status_code}")
         logger.debug(f"Request Body: {res.request.body}")
         logger.debug(f"Response Body: {res.text}")
         return res.json()
 
     def get_signing_url(self):
-        res = call_api("GET", self.ingestion_service_url + "/job/" + self.job_id + "/" + "signing-url",
-                       headers=get_headers(), is_internal=True, verify=False if "svc.cluster.local" in self.ingestion_service_url else True)
+        res = call_internal_api("GET", self.ingestion_service_url + "/job/" + self.job_id + "/" + "signing-url",
+                                self.config, verify=self.config.verify_ingestion, retry_budget=self.retry_budget)
         signed_url = res.json()["url"]
         return signed_url
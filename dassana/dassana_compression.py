@@ -0,0 +1,144 @@
+import gzip
+import os
+import struct
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+BLOCK_SIZE = 1024 * 1024
+DICT_SIZE = 32 * 1024
+
+
+class ParallelGzipFile:
+    """Write-only gzip file that compresses blocks of input on several threads.
+
+    Every block is deflated on its own, primed with the last 32 KiB of the previous block, and ends on a byte
+    boundary so the blocks concatenate into one regular deflate stream. The output is a single gzip member
+    any gzip reader can decompress. Like GzipFile with a fileobj, closing it does not close fileobj.
+    """
+
+    def __init__(self, fileobj, compresslevel=9, threads=None, block_size=BLOCK_SIZE):
+        self.fileobj = fileobj
+        self.compresslevel = compresslevel
+        self.block_size = block_size
+        self.threads = threads or os.cpu_count() or 1
+        self.executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="dassana-gzip")
+        self.pending = deque()
+        self.buffer = bytearray()
+        self.last_block = b''
+        self.crc = zlib.crc32(b'')
+        self.size = 0
+        self.closed = False
+        self.write_header()
+
+    def write_header(self):
+        # magic, deflate, no flags, mtime, extra flags, unknown OS
+        self.fileobj.write(b'\x1f\x8b\x08\x00' + struct.pack('<I', int(time.time())) + b'\x00\xff')
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        if self.closed:
+            raise ValueError("write to closed file")
+        self.buffer += data
+        self.crc = zlib.crc32(data, self.crc)
+        self.size += len(data)
+        while len(self.buffer) >= self.block_size:
+            block = bytes(self.buffer[:self.block_size])
+            del self.buffer[:self.block_size]
+            self.submit_block(block, zlib.Z_SYNC_FLUSH)
+        return len(data)
+
+    def submit_block(self, block, flush_mode):
+        self.pending.append(self.executor.submit(self.compress_block, block, self.last_block, flush_mode))
+        self.last_block = block[-DICT_SIZE:] if len(block) >= DICT_SIZE else (self.last_block + block)[-DICT_SIZE:]
+        # Keep at most two blocks per thread in flight so memory stays bounded
+        while len(self.pending) > 2 * self.threads or (self.pending and self.pending[0].done()):
+            self.fileobj.write(self.pending.popleft().result())
+
+    def compress_block(self, block, zdict, flush_mode):
+        if zdict:
+            compressor = zlib.compressobj(self.compresslevel, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=zdict)
+        else:
+            compressor = zlib.compressobj(self.compresslevel, zlib.DEFLATED, -zlib.MAX_WBITS)
+        return compressor.compress(block) + compressor.flush(flush_mode)
+
+    def drain(self):
+        while self.pending:
+            self.fileobj.write(self.pending.popleft().result())
+
+    def flush(self):
+        if self.buffer:
+            self.submit_block(bytes(self.buffer), zlib.Z_SYNC_FLUSH)
+            self.buffer = bytearray()
+        self.drain()
+        self.fileobj.flush()
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            self.submit_block(bytes(self.buffer), zlib.Z_FINISH)
+            self.buffer = bytearray()
+            self.drain()
+            self.fileobj.write(struct.pack('<II', self.crc, self.size & 0xffffffff))
+            self.fileobj.flush()
+        finally:
+            self.closed = True
+            self.executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class GzipCodec:
+    name = "gzip"
+    extension = ".gz"
+    content_encoding = "gzip"
+
+    def __init__(self, level=9, threads=1):
+        self.level = 9 if level is None else level
+        self.threads = threads
+
+    def open(self, fileobj):
+        if self.threads and self.threads > 1:
+            return ParallelGzipFile(fileobj, compresslevel=self.level, threads=self.threads)
+        return gzip.GzipFile(fileobj=fileobj, mode='wb', compresslevel=self.level)
+
+
+class ZstdCodec:
+    name = "zstd"
+    extension = ".zst"
+    content_encoding = "zstd"
+
+    def __init__(self, level=3, threads=1):
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError("zstd compression requested but zstandard is not installed, install dassana[zstd]")
+        self.zstandard = zstandard
+        self.level = 3 if level is None else level
+        # zstandard uses 0 for single threaded compression and -1 for one thread per core
+        self.threads = 0 if not threads or threads == 1 else threads
+
+    def open(self, fileobj):
+        # Compressors are not thread safe, every chunk gets its own
+        compressor = self.zstandard.ZstdCompressor(level=self.level, threads=self.threads)
+        return compressor.stream_writer(fileobj, closefd=False)
+
+
+codecs = {
+    "gzip": GzipCodec,
+    "zstd": ZstdCodec,
+}
+
+
+def get_codec(compression="gzip", level=None, threads=1):
+    if compression not in codecs:
+        raise ValueError(f"Unsupported compression {compression}, expected one of {', '.join(codecs)}")
+    return codecs[compression](level=level, threads=threads)
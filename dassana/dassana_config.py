@@ -0,0 +1,132 @@
+import os
+import threading
+from typing import NamedTuple, Optional
+from urllib.parse import urlsplit
+
+# Hosts inside the cluster serve certificates that do not verify, control plane calls to them skip TLS verification
+INSECURE_HOST_SUFFIX = "svc.cluster.local"
+
+# Environment variable behind each field, used in the error of a required field that is not set
+ENV_NAMES = {
+    "app_id": "DASSANA_APP_ID",
+    "ingestion_config_id": "DASSANA_INGESTION_CONFIG_ID",
+    "tenant_id": "DASSANA_TENANT_ID",
+    "token": "DASSANA_TOKEN",
+    "client_id": "DASSANA_CLIENT_ID",
+    "client_secret": "DASSANA_CLIENT_SECRET",
+    "project_id": "GCP_PROJECT_ID",
+}
+
+
+def get_host(url):
+    # The app service url is configured without a scheme
+    return (urlsplit(url if "://" in url else f"//{url}").hostname or "").lower()
+
+
+def is_verified_host(host):
+    return INSECURE_HOST_SUFFIX not in host
+
+
+class DassanaConfig(NamedTuple):
+    """Settings of one Dassana tenant, read from the environment once instead of on every call.
+
+    Fields of settings that are not set are None, require() raises the same KeyError the dassana_env getters do.
+    The TLS verification of the control plane hosts is decided once when the config is created, get_verify is for
+    other urls like signed upload urls.
+    """
+    app_id: Optional[str] = None
+    ingestion_config_id: Optional[str] = None
+    tenant_id: Optional[str] = None
+    token: Optional[str] = None
+    client_id: Optional[str] = None
+    client_secret: Optional[str] = None
+    auth_url: str = "https://auth.dassana.cloud"
+    app_url: str = "app-manager.dassana.cloud"
+    ingestion_service_url: str = "https://ingestion-srv.dassana.cloud"
+    project_id: Optional[str] = None
+    partner: Optional[str] = None
+    partner_client_id: Optional[str] = None
+    partner_tenant_id: Optional[str] = None
+    s3_endpoint_url: Optional[str] = None
+    debug: int = 0
+    verify_auth: bool = True
+    verify_app: bool = True
+    verify_ingestion: bool = True
+
+    @classmethod
+    def from_env(cls, environ=None):
+        environ = os.environ if environ is None else environ
+        defaults = cls._field_defaults
+        return cls.create(
+            app_id=environ.get("DASSANA_APP_ID"),
+            ingestion_config_id=environ.get("DASSANA_INGESTION_CONFIG_ID"),
+            tenant_id=environ.get("DASSANA_TENANT_ID"),
+            token=environ.get("DASSANA_TOKEN"),
+            client_id=environ.get("DASSANA_CLIENT_ID"),
+            client_secret=environ.get("DASSANA_CLIENT_SECRET"),
+            auth_url=environ.get("DASSANA_AUTH_URL", defaults["auth_url"]),
+            app_url=environ.get("DASSANA_APP_SERVICE_URL", defaults["app_url"]),
+            ingestion_service_url=environ.get("DASSANA_INGESTION_SERVICE_URL", defaults["ingestion_service_url"]),
+            project_id=environ.get("GCP_PROJECT_ID"),
+            partner=environ.get("DASSANA_PARTNER"),
+            partner_client_id=environ.get("DASSANA_PARTNER_CLIENT_ID"),
+            partner_tenant_id=environ.get("DASSANA_PARTNER_TENANT_ID"),
+            s3_endpoint_url=environ.get("DASSANA_S3_ENDPOINT_URL"),
+            debug=int(environ.get("DASSANA_DEBUG", 0)),
+        )
+
+    @classmethod
+    def create(cls, **settings):
+        """Builds a config from keyword settings, e.g. for a second tenant or in tests."""
+        config = cls(**settings)
+        for name in ("auth_url", "app_url", "ingestion_service_url"):
+            if not get_host(getattr(config, name)):
+                raise ValueError(f"Invalid {name} {getattr(config, name)!r}")
+        return config._replace(verify_auth=is_verified_host(get_host(config.auth_url)),
+                               verify_app=is_verified_host(get_host(config.app_url)),
+                               verify_ingestion=is_verified_host(get_host(config.ingestion_service_url)))
+
+    def __repr__(self):
+        # Configs end up in logs and tracebacks, keep the credentials out of them
+        fields = {**self._asdict(), "token": self.token and "***", "client_secret": self.client_secret and "***"}
+        return f"DassanaConfig({', '.join(f'{name}={value!r}' for name, value in fields.items())})"
+
+    def replace(self, **changes):
+        return self.create(**{**self._asdict(), **changes})
+
+    @property
+    def is_internal_auth(self):
+        return self.token is None
+
+    def require(self, name):
+        value = getattr(self, name)
+        if value is None:
+            raise KeyError(f"{ENV_NAMES[name]} environment variable is not set. Review your Lambda configuration.")
+        return value
+
+    def get_tenant_id(self):
+        return self.require("tenant_id") if self.is_internal_auth else ""
+
+    def get_verify(self, url):
+        return is_verified_host(get_host(url))
+
+
+config = None
+config_lock = threading.Lock()
+
+
+def get_config():
+    """The config of this process, loaded from the environment on first use."""
+    global config
+    if config is None:
+        with config_lock:
+            if config is None:
+                config = DassanaConfig.from_env()
+    return config
+
+
+def set_config(new_config):
+    """Replaces the config of this process, None loads it from the environment again on next use."""
+    global config
+    with config_lock:
+        config = new_config
@@ -0,0 +1,98 @@
+import datetime
+import decimal
+import json
+import uuid
+
+
+def datetime_handler(val):
+    if isinstance(val, (datetime.datetime, datetime.date, datetime.time)):
+        return val.isoformat()
+    return str(val)
+
+
+def get_default(exact_decimals=False):
+    """default hook of the encoders, converts the types records commonly hold and rejects everything else."""
+
+    def default(val):
+        if isinstance(val, (datetime.datetime, datetime.date, datetime.time)):
+            return val.isoformat()
+        if isinstance(val, uuid.UUID):
+            return str(val)
+        if isinstance(val, decimal.Decimal):
+            return str(val) if exact_decimals else float(val)
+        raise TypeError(f"Object of type {type(val).__name__} is not JSON serializable")
+
+    return default
+
+
+def contains_decimal(value):
+    value_type = type(value)
+    if value_type is dict:
+        return any(contains_decimal(item) for item in value.values())
+    if value_type is list or value_type is tuple:
+        return any(contains_decimal(item) for item in value)
+    return isinstance(value, decimal.Decimal)
+
+
+# All backends write the same bytes for the same record: compact separators, UTF-8 instead of \u escapes and "/"
+# unescaped. Decimal is written as a JSON number, exact_decimals writes its exact string instead so values beyond
+# float precision survive.
+def stdlib_encoder(exact_decimals=False):
+    encode = json.JSONEncoder(default=get_default(exact_decimals), separators=(',', ':'), ensure_ascii=False).encode
+
+    def encoder(json_object):
+        return (encode(json_object) + '\n').encode('utf-8')
+
+    return encoder
+
+
+def ujson_encoder(exact_decimals=False):
+    import ujson
+
+    default = get_default(exact_decimals)
+    # ujson writes Decimal as a float without calling default, with exact_decimals records holding one go through
+    # the stdlib encoder instead. Looking for a Decimal is cheaper than copying the record to replace it.
+    exact_encoder = stdlib_encoder(exact_decimals) if exact_decimals else None
+
+    def encoder(json_object):
+        if exact_encoder is not None and contains_decimal(json_object):
+            return exact_encoder(json_object)
+        return (ujson.dumps(json_object, default=default, ensure_ascii=False,
+                            escape_forward_slashes=False) + '\n').encode('utf-8')
+
+    return encoder
+
+
+def orjson_encoder(exact_decimals=False):
+    try:
+        import orjson
+    except ImportError:
+        raise ImportError("orjson encoder requested but orjson is not installed, install dassana[orjson]")
+
+    # orjson serializes datetime and UUID natively and returns bytes, the newline is appended by orjson itself
+    option = orjson.OPT_APPEND_NEWLINE | orjson.OPT_NON_STR_KEYS
+    default = get_default(exact_decimals)
+
+    def encoder(json_object):
+        return orjson.dumps(json_object, default=default, option=option)
+
+    return encoder
+
+
+encoders = {
+    "stdlib": stdlib_encoder,
+    "ujson": ujson_encoder,
+    "orjson": orjson_encoder,
+}
+
+
+def get_encoder(encoder="ujson", exact_decimals=False):
+    """Returns a function serializing a record into a newline terminated NDJSON line as bytes.
+
+    encoder is either one of the registered backend names or a callable with the same contract.
+    """
+    if callable(encoder):
+        return encoder
+    if encoder not in encoders:
+        raise ValueError(f"Unsupported encoder {encoder}, expected one of {', '.join(encoders)}")
+    return encoders[encoder](exact_decimals)
@@ -63,11 +63,7 @@ def get_dassana_token():
     return str(os.environ["DASSANA_TOKEN"])
 
 def is_internal_auth():
-    try:
-        get_dassana_token()
-    except KeyError:
-        return True
-    return False
+    return "DASSANA_TOKEN" not in os.environ
 
 def get_project_id():
     if "GCP_PROJECT_ID" not in os.environ:
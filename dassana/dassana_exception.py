@@ -1,6 +1,18 @@
 import ujson as json
+from json import dumps as json_dumps
 from requests.models import Response
 
+# Request and response bodies kept on an ApiError are cut to this many characters
+MAX_CAPTURED_BODY = 64 * 1024
+
+
+def truncate_body(body, limit=MAX_CAPTURED_BODY):
+    if isinstance(body, (bytes, bytearray)):
+        body = bytes(body[:limit + 1]).decode("utf-8", errors="replace")
+    if isinstance(body, str) and len(body) > limit:
+        return body[:limit] + "... [truncated]"
+    return body
+
 
 class DassanaException(Exception):
     """Exception Raised when something bad happened within dassana and could not auto recover"""
@@ -66,7 +78,11 @@ class ApiResponse:
 
     @classmethod
     def from_response(cls, response: Response):
-        return cls(response.status_code, response.reason, response.headers, response.text)
+        if response is None:
+            return cls()
+        # Decode only the part of the body that is kept instead of the whole response.text
+        return cls(response.status_code, response.reason, response.headers,
+                   truncate_body(response.content[:MAX_CAPTURED_BODY + 1]) if response.content is not None else None)
 
     def __str__(self):
         response_str = f"Status code: {self.status_code} "
@@ -82,6 +98,55 @@ class ApiResponse:
         return json.dumps(self.__dict__)
 
 
+class DeferredApiRequest(ApiRequest):
+    """Request of an API call whose body is only serialized into an ApiRequest once an ApiError is raised."""
+
+    def __init__(self, method, url, json=None, data=None, track_body=True):
+        self.method = method
+        self.url = url
+        self.json = json
+        self.data = data
+        self.track_body = track_body
+
+    @property
+    def body(self):
+        if not self.track_body:
+            return None
+        if self.json is not None:
+            return truncate_body(json_dumps(self.json, default=str))
+        from .api import encode_params
+        return truncate_body(encode_params(self.data))
+
+    def capture(self):
+        return ApiRequest(self.method, self.url, self.body)
+
+    def to_json(self):
+        return self.capture().to_json()
+
+
+class DeferredApiResponse(ApiResponse):
+    """Wraps the response of an API call for status validation, the body is only decoded when it is captured."""
+
+    def __init__(self, response):
+        self.response = response
+        self.status_code = response.status_code
+        self.status_message = response.reason
+
+    @property
+    def headers(self):
+        return dict(self.response.headers)
+
+    @property
+    def body(self):
+        return ApiResponse.from_response(self.response).body
+
+    def capture(self):
+        return ApiResponse.from_response(self.response)
+
+    def __json__(self):
+        return self.capture().__json__()
+
+
 class ApiError(DassanaException):
     """Exception Raised when api request failed"""
     http_response = None
@@ -89,6 +154,11 @@ class ApiError(DassanaException):
     def __init__(self, http_request: ApiRequest, http_response: ApiResponse, is_internal, error_type="internal_error",
                  error_details=None, is_auto_recoverable=False):
         super().__init__(error_details)
+        # Deferred request and response are captured here, errors only ever hold plain ApiRequest and ApiResponse
+        if isinstance(http_request, DeferredApiRequest):
+            http_request = http_request.capture()
+        if isinstance(http_response, DeferredApiResponse):
+            http_response = http_response.capture()
         self.http_request = http_request
         if http_response is not None:
             self.http_response = http_response
@@ -121,6 +191,8 @@ class NetworkError(ApiError):
     message = "Connection/Network Failure"
 
     def __init__(self, request, error_msg, is_internal):
+        if isinstance(error_msg, DeferredApiResponse):
+            error_msg = error_msg.capture()
         super().__init__(request, ApiResponse(), error_type=self.error_type, error_details=error_msg, 
                          is_auto_recoverable=True, is_internal=is_internal)
 
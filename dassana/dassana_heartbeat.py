@@ -0,0 +1,100 @@
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Final
+
+logger: Final = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+
+class HeartbeatManager:
+    """Calls send(job_id, *args) for every registered job once per interval seconds.
+
+    The heartbeats of one round are spread over a random offset of up to jitter * interval seconds each and
+    sent by a pool of workers, so many jobs in one process neither wait on each other nor hit the service in
+    one burst. The thread starts with the first registered job and stops on shutdown.
+    """
+
+    def __init__(self, send, interval=1800, jitter=0.1, workers=8):
+        self.send = send
+        self.interval = interval
+        self.jitter = jitter
+        self.workers = workers
+        self.lock = threading.Lock()
+        # job id -> the extra arguments it was registered with
+        self.jobs = {}
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.executor = None
+
+    def register(self, job_id, *args):
+        with self.lock:
+            self.jobs[job_id] = args
+            self.start_locked()
+
+    def unregister(self, job_id):
+        with self.lock:
+            self.jobs.pop(job_id, None)
+
+    def is_registered(self, job_id):
+        with self.lock:
+            return job_id in self.jobs
+
+    def start_locked(self):
+        if self.thread is not None and self.thread.is_alive():
+            return
+        self.stop_event = threading.Event()
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="dassana-heartbeat")
+        self.thread = threading.Thread(target=self.run, args=(self.stop_event, self.executor),
+                                       name="dassana-heartbeat", daemon=True)
+        self.thread.start()
+
+    def run(self, stop_event, executor):
+        next_time = time.monotonic() + self.interval
+        while not stop_event.wait(max(0.0, next_time - time.monotonic())):
+            self.beat(stop_event, executor)
+            # Rounds that were missed while this one ran are skipped rather than sent back to back
+            next_time += ((time.monotonic() - next_time) // self.interval + 1) * self.interval
+
+    def beat(self, stop_event, executor):
+        with self.lock:
+            jobs = list(self.jobs.items())
+        round_start = time.monotonic()
+        offsets = sorted(((random.uniform(0, self.jitter * self.interval), index) for index in range(len(jobs))))
+        for offset, index in offsets:
+            if stop_event.wait(max(0.0, round_start + offset - time.monotonic())):
+                return
+            job_id, args = jobs[index]
+            executor.submit(self.send_heartbeat, job_id, *args)
+
+    def send_heartbeat(self, job_id, *args):
+        # The job may have finished while its heartbeat was waiting for its turn
+        if not self.is_registered(job_id):
+            return
+        try:
+            self.send(job_id, *args)
+            logger.info(f"Updated job status for job id: {job_id}")
+        except Exception as exp:
+            logger.warning(f"Failed to update job ({job_id}) heartbeat due to {exp}")
+
+    def configure(self, interval=None, jitter=None, workers=None):
+        """Changes the settings, interval and jitter apply from the next round, workers once it is started again."""
+        with self.lock:
+            if interval is not None:
+                self.interval = interval
+            if jitter is not None:
+                self.jitter = jitter
+            if workers is not None:
+                self.workers = workers
+
+    def shutdown(self, wait=True):
+        with self.lock:
+            thread, executor = self.thread, self.executor
+            self.thread = self.executor = None
+            self.stop_event.set()
+        if thread is not None and wait:
+            thread.join()
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=True)
@@ -1,10 +1,15 @@
+import atexit
 import datetime
+import functools
+import threading
+import time
+from collections import deque
 from uuid import uuid4
 
-from .dassana_publisher import publish_message
-from .dassana_env import *
+from .dassana_config import get_config
+from .dassana_publisher import DropCounter, flush as flush_publisher, publish_message
 
-from typing import Final
+from typing import Final, NamedTuple, Optional
 import logging, json
 import dassana.dassana_exception as exc
 
@@ -12,16 +17,189 @@ import dassana.dassana_exception as exc
 logger: Final = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
-tenant_id = get_tenant_id()
-dassana_partner = get_partner()
-dassana_partner_client_id = get_partner_client_id()
-dassana_partner_tenant_id = get_partner_tenant_id()
-config_id = get_ingestion_config_id()
-app_id = get_app_id()
 
-topic_name = None
-if dassana_partner:
-    topic_name = dassana_partner + "_log_event_topic"
+def get_log_context(config=None):
+    # Resolved on the first log instead of on import, so importing dassana does not need the job environment
+    return build_log_context(config or get_config())
+
+
+@functools.lru_cache(maxsize=None)
+def build_log_context(config):
+    dassana_partner = config.partner
+    return {
+        "tenant_id": config.get_tenant_id(),
+        "dassana_partner": dassana_partner,
+        "dassana_partner_client_id": config.partner_client_id,
+        "dassana_partner_tenant_id": config.partner_tenant_id,
+        "config_id": str(config.require("ingestion_config_id")),
+        "app_id": config.require("app_id"),
+        "topic_name": dassana_partner + "_log_event_topic" if dassana_partner else None,
+        "project_id": config.project_id,
+    }
+
+
+# log() only builds the event and queues it, a background thread serializes it, writes it to the logger and hands
+# it to the publisher. At most max_events wait to be written, overflow decides what happens beyond that: "drop"
+# discards the event, "block" makes the caller wait for room. Events with the final status of a job always wait.
+# background=False writes every event in log() itself.
+log_pipeline_config = {
+    "max_events": 10000,
+    "overflow": "drop",
+    "background": True,
+    "drain_timeout": 30,
+}
+
+
+def copy_event_data(value):
+    # Events are serialized later on the pipeline thread, the dicts and lists they share with the caller
+    # (metadata, the request and response of an ApiError) must not change until then
+    if isinstance(value, dict):
+        return {key: copy_event_data(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [copy_event_data(item) for item in value]
+    return value
+
+
+class LogEvent(NamedTuple):
+    failed: bool
+    developer_ctx: dict
+    customer_ctx: dict
+    topic_name: Optional[str]
+    project_id: Optional[str] = None
+
+
+def write_event(event):
+    if event.failed:
+        logger.error(msg=json.dumps(event.developer_ctx))
+    else:
+        logger.info(msg=json.dumps(event.developer_ctx))
+    if event.topic_name:
+        publish_message(event.customer_ctx, event.topic_name, event.project_id)
+
+
+class LogPipeline:
+    """Writes log events on a background thread and keeps count of what happened to them.
+
+    Events are written in the order they were submitted. The thread starts with the first event, drain waits
+    until every event submitted so far has been written.
+    """
+
+    def __init__(self, config):
+        if config["overflow"] not in ("drop", "block"):
+            raise ValueError(f"Unsupported overflow {config['overflow']}, expected one of drop, block")
+        self.config = config
+        self.condition = threading.Condition()
+        self.events = deque()
+        # Events queued or being written
+        self.pending = 0
+        self.written = 0
+        self.failed = 0
+        self.drops = DropCounter(logger, "Log queue is full, dropped {dropped} log events so far")
+        self.stopped = False
+        self.thread = None
+
+    def submit(self, event, required=False):
+        """Queues event, required events wait for room in the queue instead of being dropped."""
+        with self.condition:
+            if not self.config["background"] or self.stopped:
+                queued = False
+            elif required or self.config["overflow"] == "block" or len(self.events) < self.config["max_events"]:
+                self.condition.wait_for(lambda: len(self.events) < self.config["max_events"] or self.stopped)
+                queued = not self.stopped
+                if queued:
+                    self.events.append(event)
+                    self.pending += 1
+                    self.condition.notify_all()
+                    if self.thread is None or not self.thread.is_alive():
+                        self.thread = threading.Thread(target=self.run, name="dassana-log", daemon=True)
+                        self.thread.start()
+            else:
+                self.drops.drop()
+                return
+        if not queued:
+            self.write(event)
+
+    def run(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.events or self.stopped)
+                if not self.events:
+                    return
+                events = list(self.events)
+                self.events.clear()
+                self.condition.notify_all()
+            for event in events:
+                self.write(event)
+            with self.condition:
+                self.pending -= len(events)
+                self.condition.notify_all()
+
+    def write(self, event):
+        try:
+            write_event(event)
+            written = True
+        except Exception as exp:
+            logger.error(f"Failed to write log event because of {exp}")
+            written = False
+        with self.condition:
+            if written:
+                self.written += 1
+            else:
+                self.failed += 1
+
+    def drain(self, timeout=None):
+        """Waits for the queued events to be written, returns how many are still pending."""
+        with self.condition:
+            self.condition.wait_for(lambda: self.pending == 0, timeout)
+            return self.pending
+
+    def stop(self):
+        """Lets the thread exit once the queue is empty, events submitted afterwards are written by the caller."""
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+
+    def stats(self):
+        with self.condition:
+            return {"written": self.written, "failed": self.failed, "dropped": self.drops.dropped,
+                    "pending": self.pending}
+
+
+log_pipeline = LogPipeline(dict(log_pipeline_config))
+log_pipeline_lock = threading.Lock()
+
+
+def configure_log_pipeline(**settings):
+    """Changes log_pipeline_config, events logged so far are written before the new settings apply."""
+    global log_pipeline
+    unknown = set(settings) - set(log_pipeline_config)
+    if unknown:
+        raise ValueError(f"Unknown log pipeline settings {', '.join(sorted(unknown))}")
+    with log_pipeline_lock:
+        new_config = {**log_pipeline_config, **settings}
+        new_pipeline = LogPipeline(new_config)
+        log_pipeline.drain(log_pipeline_config["drain_timeout"])
+        log_pipeline.stop()
+        log_pipeline_config.update(new_config)
+        log_pipeline = new_pipeline
+
+
+def get_log_stats():
+    return log_pipeline.stats()
+
+
+def flush_logs(timeout=None):
+    """Waits until the events logged so far are written and published, returns how many are still pending."""
+    timeout = log_pipeline_config["drain_timeout"] if timeout is None else timeout
+    deadline = time.monotonic() + timeout
+    pending = log_pipeline.drain(timeout)
+    if pending:
+        logger.error(f"Failed to write all the log events, {pending} are still pending")
+    return pending + flush_publisher(max(0.0, deadline - time.monotonic()))
+
+
+# Registered after the publisher's flush so it runs before it, events still queued here get published first
+atexit.register(flush_logs)
 
 scope_id_mapping = {
     "crowdstrike_edr": "detection",
@@ -40,31 +218,29 @@ scope_id_mapping = {
     "ms_defender_endpoint_vulnerability": "vulnerability"
 }
 
-def log(status=None, exception=None, locals={}, scope_id=None, metadata={}, job_id=None):
-    state = build_state(scope_id, locals, job_id, status, exception)
+def log(status=None, exception=None, locals={}, scope_id=None, metadata={}, job_id=None, config=None):
+    context = get_log_context(config)
+    state = build_state(scope_id, locals, job_id, status, exception, context)
     message = {}
 
     message["developerCtx"] = {}
     message["developerCtx"].update(state)
-    message["developerCtx"].update(add_developer_context(metadata, state["status"], exception))
+    message["developerCtx"].update(add_developer_context(metadata, state["status"], exception, context))
 
     message["customerCtx"] = {}
     message["customerCtx"].update(state)
-    message["customerCtx"].update(add_customer_context(message["customerCtx"], exception))
+    message["customerCtx"].update(add_customer_context(message["customerCtx"], exception, context))
 
-    if state["status"] == "failed":
-        logger.error(msg=json.dumps(message["developerCtx"]))
-    else:
-        logger.info(msg=json.dumps(message["developerCtx"]))
-    
-    message = message["customerCtx"]
-    
-    if dassana_partner:
-        publish_message(message, topic_name)
+    # Events reporting how a job ended are never dropped, the job status would be lost with them
+    log_pipeline.submit(LogEvent(state["status"] == "failed", copy_event_data(message["developerCtx"]),
+                                 copy_event_data(message["customerCtx"]),
+                                 context["topic_name"] if context["dassana_partner"] else None, context["project_id"]),
+                        required=state["status"] != "in_progress")
 
-def add_developer_context(metadata, status ,exception):
+def add_developer_context(metadata, status ,exception, context=None):
+    context = context or get_log_context()
     state = {}
-    state["tenantId"] = tenant_id
+    state["tenantId"] = context["tenant_id"]
     if status == 'ready_for_loading' and metadata:
         state["source"] = {}
         state["source"]["pass"] = metadata["source"]["pass"]
@@ -115,10 +291,14 @@ def add_developer_context(metadata, status ,exception):
             state["errorDetails"]["errorMessage"] = "Unexpected error occurred while collecting data"
     return state
   
-def add_customer_context(state, exception=None):
+def add_customer_context(state, exception=None, context=None):
 
 
     state["status"] = "ok" if state.get("status") == "ready_for_loading" else state.get("status")
+    context = context or get_log_context()
+    dassana_partner = context["dassana_partner"]
+    dassana_partner_client_id = context["dassana_partner_client_id"]
+    dassana_partner_tenant_id = context["dassana_partner_tenant_id"]
     if dassana_partner and dassana_partner_tenant_id:
         state["tenantId"] = dassana_partner_tenant_id
     elif dassana_partner and not dassana_partner_tenant_id:
@@ -143,12 +323,13 @@ def add_customer_context(state, exception=None):
         state["errorDetails"]["message"] = "Job terminated due to internal error"
     return state
 
-def build_state(scope_id, locals, job_id, status, exception):
+def build_state(scope_id, locals, job_id, status, exception, context=None):
+    context = context or get_log_context()
     state = {}
 
     state["eventId"] = str(uuid4())
     state["timestamp"] = datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
-    state["connector"] = app_id
+    state["connector"] = context["app_id"]
     if exception:
         state["status"] = "failed"
     elif not exception and not status:
@@ -173,7 +354,7 @@ def build_state(scope_id, locals, job_id, status, exception):
     if 'config_id' in locals:
         state["connectionId"] = locals.get("config_id")
     else:
-        state["connectionId"] = config_id
+        state["connectionId"] = context["config_id"]
         
     if scope_id:
         state["scopeId"] = scope_id_mapping.get(scope_id, scope_id)
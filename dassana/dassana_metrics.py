@@ -0,0 +1,209 @@
+import re
+import threading
+from bisect import bisect_left
+from urllib.parse import urlsplit
+
+# Seconds, the last bucket catches everything slower
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, float("inf"))
+
+# Path segments that identify a single resource are folded into {id} so calls group by endpoint
+ID_SEGMENT = re.compile(r"^(\d+|[0-9a-fA-F-]{32,36}|[0-9a-fA-F]{16,}|(?=.*\d)[\w-]{20,})$")
+
+
+endpoint_templates = []
+
+
+def register_endpoints(*templates):
+    """Adds path templates like "/repos/{owner}/{repo}/issues" that paths are grouped by before ids are guessed."""
+    for template in templates:
+        pattern = re.sub(r"\\{\w+\\}", "[^/]+", re.escape(template))
+        endpoint_templates.append((re.compile(f"^{pattern}$"), template))
+
+
+def get_endpoint(url):
+    """Endpoint template of url, its path with resource ids replaced by {id} and without the query string."""
+    path = urlsplit(url).path or "/"
+    for pattern, template in endpoint_templates:
+        if pattern.match(path):
+            return template
+    return "/".join("{id}" if ID_SEGMENT.match(segment) else segment for segment in path.split("/"))
+
+
+def get_request_size(response, data=None):
+    request = getattr(response, "request", None)
+    body = getattr(request, "body", None) if request is not None else data
+    return len(body) if isinstance(body, (str, bytes, bytearray)) else 0
+
+
+def get_response_size(response):
+    content_length = response.headers.get("Content-Length")
+    if content_length is not None and content_length.isdigit():
+        return int(content_length)
+    # requests keeps a body it has read in _content, going through .content would consume a streamed body
+    content = response._content if hasattr(response, "_content") else response.content
+    return len(content) if isinstance(content, (bytes, bytearray)) else 0
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def to_json(self):
+        return {"count": self.count, "sum": round(self.sum, 6),
+                "buckets": {format_bound(bound): count for bound, count in zip(self.buckets, self.counts)}}
+
+
+class EndpointMetrics:
+    def __init__(self):
+        self.calls = 0
+        self.failed_calls = 0
+        self.attempts = 0
+        self.status = {}
+        self.bytes_in = 0
+        self.bytes_out = 0
+        # latency is measured per attempt, duration per call including retries and their backoff
+        self.latency = Histogram()
+        self.duration = Histogram()
+
+    def to_json(self):
+        return {"calls": self.calls, "failed_calls": self.failed_calls, "attempts": self.attempts,
+                "retries": max(0, self.attempts - self.calls), "status": dict(self.status),
+                "bytes_in": self.bytes_in, "bytes_out": self.bytes_out,
+                "latency": self.latency.to_json(), "duration": self.duration.to_json()}
+
+
+class MetricsRegistry:
+    """Per host, method and endpoint template metrics of the calls made through call_api.
+
+    Every attempt adds its latency, status and bytes sent and received, every call its total duration, so
+    the retries of an endpoint are its attempts minus its calls. Attempts failing without a response count
+    under the name of the exception instead of a status code.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.endpoints = {}
+        # Registries that also receive everything recorded here while they are attached
+        self.scopes = []
+
+    def get_endpoint_metrics(self, method, url, endpoint=None):
+        key = (urlsplit(url).netloc, method.upper(), endpoint or get_endpoint(url))
+        endpoint_metrics = self.endpoints.get(key)
+        if endpoint_metrics is None:
+            endpoint_metrics = self.endpoints.setdefault(key, EndpointMetrics())
+        return endpoint_metrics
+
+    def record_attempt(self, method, url, status, latency, bytes_out=0, bytes_in=0, endpoint=None):
+        endpoint = endpoint or get_endpoint(url)
+        with self.lock:
+            endpoint_metrics = self.get_endpoint_metrics(method, url, endpoint)
+            endpoint_metrics.attempts += 1
+            endpoint_metrics.status[str(status)] = endpoint_metrics.status.get(str(status), 0) + 1
+            endpoint_metrics.bytes_out += bytes_out
+            endpoint_metrics.bytes_in += bytes_in
+            endpoint_metrics.latency.observe(latency)
+            scopes = list(self.scopes)
+        for scope in scopes:
+            scope.record_attempt(method, url, status, latency, bytes_out, bytes_in, endpoint)
+
+    def record_call(self, method, url, duration, failed=False, endpoint=None):
+        endpoint = endpoint or get_endpoint(url)
+        with self.lock:
+            endpoint_metrics = self.get_endpoint_metrics(method, url, endpoint)
+            endpoint_metrics.calls += 1
+            endpoint_metrics.failed_calls += int(failed)
+            endpoint_metrics.duration.observe(duration)
+            scopes = list(self.scopes)
+        for scope in scopes:
+            scope.record_call(method, url, duration, failed, endpoint)
+
+    def start_scope(self):
+        """Returns a registry counting only what is recorded from now on until it is passed to end_scope."""
+        scope = MetricsRegistry()
+        with self.lock:
+            self.scopes.append(scope)
+        return scope
+
+    def end_scope(self, scope):
+        with self.lock:
+            if scope in self.scopes:
+                self.scopes.remove(scope)
+        return scope
+
+    def reset(self):
+        with self.lock:
+            self.endpoints.clear()
+
+    def to_json(self):
+        with self.lock:
+            return [{"host": host, "method": method, "endpoint": endpoint, **endpoint_metrics.to_json()}
+                    for (host, method, endpoint), endpoint_metrics in sorted(self.endpoints.items())]
+
+    def to_prometheus(self, prefix="dassana_api"):
+        lines = []
+        with self.lock:
+            endpoints = sorted(self.endpoints.items())
+            for name, kind, help_text in (
+                    ("calls_total", "counter", "Calls made through call_api"),
+                    ("failed_calls_total", "counter", "Calls that failed after all retries"),
+                    ("attempts_total", "counter", "Requests sent, including retries"),
+                    ("retries_total", "counter", "Requests sent again after a failed attempt"),
+                    ("requests_by_status_total", "counter", "Requests sent by response status"),
+                    ("received_bytes_total", "counter", "Response bytes received"),
+                    ("sent_bytes_total", "counter", "Request body bytes sent"),
+                    ("request_latency_seconds", "histogram", "Latency of a single request"),
+                    ("call_duration_seconds", "histogram", "Duration of a call including retries")):
+                lines.append(f"# HELP {prefix}_{name} {help_text}")
+                lines.append(f"# TYPE {prefix}_{name} {kind}")
+                for (host, method, endpoint), endpoint_metrics in endpoints:
+                    labels = f'host="{escape(host)}",method="{method}",endpoint="{escape(endpoint)}"'
+                    lines.extend(prometheus_samples(f"{prefix}_{name}", labels, name, endpoint_metrics))
+        return "\n".join(lines) + "\n"
+
+
+def prometheus_samples(metric, labels, name, endpoint_metrics):
+    if name == "requests_by_status_total":
+        return [f'{metric}{{{labels},status="{escape(status)}"}} {count}'
+                for status, count in sorted(endpoint_metrics.status.items())]
+    if name in ("request_latency_seconds", "call_duration_seconds"):
+        histogram = endpoint_metrics.latency if name == "request_latency_seconds" else endpoint_metrics.duration
+        samples = []
+        cumulative = 0
+        for bound, count in zip(histogram.buckets, histogram.counts):
+            cumulative += count
+            samples.append(f'{metric}_bucket{{{labels},le="{format_bound(bound)}"}} {cumulative}')
+        samples.append(f"{metric}_sum{{{labels}}} {histogram.sum:.6f}")
+        samples.append(f"{metric}_count{{{labels}}} {histogram.count}")
+        return samples
+    values = endpoint_metrics.to_json()
+    value = {"calls_total": values["calls"], "failed_calls_total": values["failed_calls"],
+             "attempts_total": values["attempts"], "retries_total": values["retries"],
+             "received_bytes_total": values["bytes_in"], "sent_bytes_total": values["bytes_out"]}[name]
+    return [f"{metric}{{{labels}}} {value}"]
+
+
+def format_bound(bound):
+    return "+Inf" if bound == float("inf") else f"{bound:g}"
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+metrics = MetricsRegistry()
+
+
+def get_metrics():
+    return metrics.to_json()
+
+
+def get_metrics_prometheus():
+    return metrics.to_prometheus()
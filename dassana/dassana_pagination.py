@@ -0,0 +1,211 @@
+import logging
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Final
+
+from .api import call_api
+
+logger: Final = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+
+def get_path(obj, path):
+    """Looks up a dotted path like "data.items" in parsed JSON, None when any part of it is missing."""
+    if not path:
+        return obj
+    for key in path.split("."):
+        if isinstance(obj, list) and key.isdigit():
+            obj = obj[int(key)] if int(key) < len(obj) else None
+        elif isinstance(obj, dict):
+            obj = obj.get(key)
+        else:
+            return None
+        if obj is None:
+            return None
+    return obj
+
+
+class Paginator:
+    """Describes how the pages of a listing API are requested and where the records are in a page.
+
+    A request is the dict of url, params and json passed on to call_api. Paginators whose pages can be
+    requested without looking at the previous one set concurrent and implement page_request, the others
+    implement next_request.
+    """
+    concurrent = False
+
+    def __init__(self, records_path=None):
+        self.records_path = records_path
+
+    def records(self, page):
+        return get_path(page, self.records_path) or []
+
+    def next_request(self, request, response, page, records):
+        """Returns the request for the page after response, None when response was the last page."""
+        raise NotImplementedError
+
+    def page_request(self, request, index):
+        raise NotImplementedError
+
+    def is_last(self, records):
+        raise NotImplementedError
+
+
+class CursorPaginator(Paginator):
+    """Pages carry the cursor of the next page at cursor_path, sent back as cursor_param in the params or json body."""
+
+    def __init__(self, cursor_path, cursor_param, records_path=None, cursor_in="params"):
+        super().__init__(records_path)
+        if cursor_in not in ("params", "json"):
+            raise ValueError(f"Unsupported cursor_in {cursor_in}, expected params or json")
+        self.cursor_path = cursor_path
+        self.cursor_param = cursor_param
+        self.cursor_in = cursor_in
+
+    def next_request(self, request, response, page, records):
+        cursor = get_path(page, self.cursor_path)
+        if not cursor or not records:
+            return None
+        values = dict(request.get(self.cursor_in) or {})
+        values[self.cursor_param] = cursor
+        return {**request, self.cursor_in: values}
+
+
+class OffsetPaginator(Paginator):
+    """Pages are addressed by offset and limit query parameters, or by page number with page_numbers set.
+
+    The listing ends on the first page holding fewer than limit records. Pages are independent, so several
+    of them are fetched at once.
+    """
+    concurrent = True
+
+    def __init__(self, limit, records_path=None, offset_param="offset", limit_param="limit", start=0,
+                 page_numbers=False):
+        super().__init__(records_path)
+        self.limit = limit
+        self.offset_param = offset_param
+        self.limit_param = limit_param
+        self.start = start
+        self.page_numbers = page_numbers
+
+    def page_request(self, request, index):
+        params = dict(request.get("params") or {})
+        params[self.offset_param] = self.start + (index if self.page_numbers else index * self.limit)
+        if self.limit_param:
+            params[self.limit_param] = self.limit
+        return {**request, "params": params}
+
+    def is_last(self, records):
+        return len(records) < self.limit
+
+
+class LinkHeaderPaginator(Paginator):
+    """The URL of the next page comes in the Link response header with rel="next", as GitHub style APIs do."""
+
+    def next_request(self, request, response, page, records):
+        next_link = response.links.get("next", {}).get("url")
+        if not next_link:
+            return None
+        # The link already carries the query string of the next page
+        return {**request, "url": next_link, "params": None}
+
+
+class PageFailure:
+    def __init__(self, exp):
+        self.exp = exp
+
+
+PAGES_END = object()
+
+
+def fetch_page(method, request, paginator, call_api_kwargs):
+    response = call_api(method, request["url"], params=request.get("params"), json=request.get("json"),
+                        **call_api_kwargs)
+    page = response.json()
+    return response, page, paginator.records(page)
+
+
+def iterate_pages(method, request, paginator, call_api_kwargs):
+    while request is not None:
+        response, page, records = fetch_page(method, request, paginator, call_api_kwargs)
+        yield records
+        request = paginator.next_request(request, response, page, records)
+
+
+def iterate_pages_ahead(method, request, paginator, call_api_kwargs, prefetch):
+    # Pages depend on each other, a single thread walks them and keeps up to prefetch pages ready
+    pages = queue.Queue(maxsize=prefetch)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                pages.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def fetch_pages():
+        try:
+            for records in iterate_pages(method, request, paginator, call_api_kwargs):
+                if not put(records):
+                    return
+            put(PAGES_END)
+        except BaseException as exp:
+            put(PageFailure(exp))
+
+    threading.Thread(target=fetch_pages, name="dassana-pagination", daemon=True).start()
+    try:
+        while True:
+            item = pages.get()
+            if item is PAGES_END:
+                return
+            if isinstance(item, PageFailure):
+                raise item.exp
+            yield item
+    finally:
+        stop.set()
+
+
+def iterate_pages_concurrently(method, request, paginator, call_api_kwargs, prefetch):
+    # Pages are independent, up to prefetch of them are in flight and handed out in order
+    executor = ThreadPoolExecutor(max_workers=prefetch, thread_name_prefix="dassana-pagination")
+    pending = deque()
+    index = 0
+    try:
+        while True:
+            while len(pending) < prefetch:
+                pending.append(executor.submit(fetch_page, method, paginator.page_request(request, index),
+                                               paginator, call_api_kwargs))
+                index += 1
+            records = pending.popleft().result()[2]
+            yield records
+            if paginator.is_last(records):
+                return
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=False)
+
+
+def paginate(method, url, paginator, params=None, json=None, prefetch=2, **call_api_kwargs):
+    """Yields the records of every page of a listing API, fetching up to prefetch pages ahead of the caller.
+
+    Remaining keyword arguments go to call_api for every page. prefetch=0 fetches each page only when the
+    previous one is used up.
+    """
+    request = {"url": url, "params": params, "json": json}
+    if prefetch <= 0:
+        if paginator.concurrent:
+            pages = iterate_pages_concurrently(method, request, paginator, call_api_kwargs, 1)
+        else:
+            pages = iterate_pages(method, request, paginator, call_api_kwargs)
+    elif paginator.concurrent:
+        pages = iterate_pages_concurrently(method, request, paginator, call_api_kwargs, prefetch)
+    else:
+        pages = iterate_pages_ahead(method, request, paginator, call_api_kwargs, prefetch)
+    for records in pages:
+        yield from records
@@ -1,38 +1,174 @@
-from typing import Final, Callable
-from google.cloud import pubsub_v1
-from concurrent import futures
+from typing import Final
 from concurrent.futures import wait
-from .dassana_env import *
+from .dassana_config import get_config
+import atexit
 import json
 import logging
+import threading
 
-publisher = None
-topic_path = None
 logger: Final = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
-def publish_message(message, topic_name):
+# Messages are batched by the Pub/Sub client and sent from its own threads, publish_message only enqueues them.
+# A batch goes out once it holds max_messages, max_bytes or is max_latency seconds old. At most
+# max_pending_messages / max_pending_bytes wait to be published, overflow decides what happens beyond that:
+# "drop" discards the message, "block" makes the caller wait for room.
+publisher_config = {
+    "max_messages": 100,
+    "max_bytes": 1024 * 1024,
+    "max_latency": 0.05,
+    "max_pending_messages": 1000,
+    "max_pending_bytes": 10 * 1024 * 1024,
+    "overflow": "drop",
+    "publish_timeout": 180,
+    "flush_timeout": 30,
+}
+# Names of the LimitExceededBehavior of the client, resolved once the client is created
+overflow_behaviors = {
+    "drop": "ERROR",
+    "block": "BLOCK",
+}
+
+
+class DropCounter:
+    """Counts what a full queue discarded, warns with message on the first drop and then on every hundredth.
+
+    A flood of drops does not flood the log as well. message is formatted with dropped and the details of drop.
+    """
+
+    def __init__(self, logger, message):
+        self.logger = logger
+        self.message = message
+        self.lock = threading.Lock()
+        self.dropped = 0
+
+    def drop(self, **details):
+        with self.lock:
+            self.dropped += 1
+            dropped = self.dropped
+        if dropped % 100 == 1:
+            self.logger.warning(self.message.format(dropped=dropped, **details))
+
+
+class BatchPublisher:
+    """Publishes messages to Pub/Sub in the background and keeps count of what happened to them.
+
+    Honors PUBSUB_EMULATOR_HOST like any Pub/Sub client, so it can run against the local emulator. Messages go to
+    the topic of project_id unless publish is given the project of their tenant.
+    """
+
+    def __init__(self, project_id, config):
+        if config["overflow"] not in overflow_behaviors:
+            raise ValueError(f"Unsupported overflow {config['overflow']}, expected one of "
+                             f"{', '.join(overflow_behaviors)}")
+        # The Pub/Sub client is only imported by processes that publish, importing it takes a while
+        from google.cloud import pubsub_v1
+        from google.cloud.pubsub_v1.publisher.exceptions import FlowControlLimitError
+
+        self.flow_control_error = FlowControlLimitError
+        self.project_id = project_id
+        self.config = config
+        self.client = pubsub_v1.PublisherClient(
+            batch_settings=pubsub_v1.types.BatchSettings(max_messages=config["max_messages"],
+                                                         max_bytes=config["max_bytes"],
+                                                         max_latency=config["max_latency"]),
+            publisher_options=pubsub_v1.types.PublisherOptions(
+                flow_control=pubsub_v1.types.PublishFlowControl(
+                    message_limit=config["max_pending_messages"], byte_limit=config["max_pending_bytes"],
+                    limit_exceeded_behavior=getattr(pubsub_v1.types.LimitExceededBehavior,
+                                                    overflow_behaviors[config["overflow"]]))))
+        self.topic_paths = {}
+        self.lock = threading.Lock()
+        self.pending = set()
+        self.published = 0
+        self.failed = 0
+        self.drops = DropCounter(logger,
+                                 "Publish queue is full, dropped {dropped} messages to topic {topic_name} so far")
+
+    def publish(self, message, topic_name, project_id=None):
+        project_id = project_id or self.project_id
+        if project_id is None:
+            raise KeyError("GCP_PROJECT_ID environment variable is not set. Review your configuration.")
+        topic_path = self.topic_paths.get((project_id, topic_name))
+        if topic_path is None:
+            topic_path = self.topic_paths.setdefault((project_id, topic_name),
+                                                     self.client.topic_path(project_id, topic_name))
+        publish_future = self.client.publish(topic_path, json.dumps(message).encode("utf-8"),
+                                             timeout=self.config["publish_timeout"])
+        with self.lock:
+            self.pending.add(publish_future)
+        publish_future.add_done_callback(lambda future: self.on_published(future, topic_name))
+
+    def on_published(self, publish_future, topic_name):
+        exp = publish_future.exception()
+        with self.lock:
+            self.pending.discard(publish_future)
+            if exp is None:
+                self.published += 1
+            elif not isinstance(exp, self.flow_control_error):
+                self.failed += 1
+        if isinstance(exp, self.flow_control_error):
+            # The client fails the future of a message that does not fit into the queue instead of raising
+            self.drops.drop(topic_name=topic_name)
+        elif exp is not None:
+            logger.error(f"Failed To Publish Message to topic {topic_name} Because of {exp}")
+
+    def flush(self, timeout=None):
+        """Waits for the queued messages to be published, returns how many are still pending."""
+        with self.lock:
+            pending = list(self.pending)
+        if not pending:
+            return 0
+        done, not_done = wait(pending, timeout=timeout)
+        if not_done:
+            logger.error(f"Failed To Publish all the messages, Published {len(done)}/{len(pending)} Messages")
+        return len(not_done)
+
+    def stats(self):
+        with self.lock:
+            return {"published": self.published, "failed": self.failed, "dropped": self.drops.dropped,
+                    "pending": len(self.pending)}
+
+
+publisher = None
+publisher_lock = threading.Lock()
+
+
+def configure_publisher(**settings):
+    """Changes publisher_config, takes effect for the publisher created by the next publish_message."""
     global publisher
-    global topic_path
-    try:
-        project_id = get_project_id()
-        if not publisher:
-            publisher = pubsub_v1.PublisherClient()
-        publish_futures = []
-        if not topic_path:
-            topic_path = publisher.topic_path(project_id, topic_name)
-        data = json.dumps(message)
-        # When you publish a message, the client returns a future.
-        publish_future = publisher.publish(topic_path, data.encode("utf-8"), timeout=180)
-        publish_future.result(timeout=180)
-        
-        # Non-blocking. Publish failures are handled in the callback function.
-        # publish_future.add_done_callback(get_callback(publish_future, data))
-
-        # publish_futures.append(publish_future)
-        # done, un_done = wait(publish_futures, return_when=futures.ALL_COMPLETED)
-        # if len(un_done) > 0:
-        #     logger.error(f"Failed To Publish all the messages to topic {topic_name}, Published {len(publish_futures)-len(un_done)}/{len(publish_futures)} Messages")
+    unknown = set(settings) - set(publisher_config)
+    if unknown:
+        raise ValueError(f"Unknown publisher settings {', '.join(sorted(unknown))}")
+    with publisher_lock:
+        if publisher is not None:
+            publisher.flush(publisher_config["flush_timeout"])
+            publisher.client.stop()
+            publisher = None
+        publisher_config.update(settings)
 
+
+def get_publisher():
+    global publisher
+    if publisher is None:
+        with publisher_lock:
+            if publisher is None:
+                publisher = BatchPublisher(get_config().project_id, dict(publisher_config))
+    return publisher
+
+
+def publish_message(message, topic_name, project_id=None):
+    try:
+        get_publisher().publish(message, topic_name, project_id)
     except Exception as e:
-        logger.error(f"Failed To Publish Message to topic {topic_name} Because of {e}")
\ No newline at end of file
+        logger.error(f"Failed To Publish Message to topic {topic_name} Because of {e}")
+
+
+def flush(timeout=None):
+    """Waits until the messages published so far are sent, returns how many are still pending after timeout."""
+    if publisher is None:
+        return 0
+    return publisher.flush(publisher_config["flush_timeout"] if timeout is None else timeout)
+
+
+atexit.register(flush)
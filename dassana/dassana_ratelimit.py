@@ -0,0 +1,142 @@
+import logging
+import threading
+import time
+from typing import Final
+from urllib.parse import urlsplit
+
+from .dassana_retry import get_rate_limit_window, get_retry_after
+
+logger: Final = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+THROTTLED_STATUS_CODES = (429, 503)
+
+
+class RateLimiter:
+    """Token bucket pacing the requests call_api sends to one host.
+
+    rate is in requests per second and burst is how many requests may go out back to back after an idle period.
+    With adaptive set the rate follows the server (AIMD): it grows by increase requests per second for every
+    second without throttling, a 429 or 503 multiplies it by decrease at most once per throttling window, and
+    Retry-After or rate limit headers pause the bucket or pace the remaining requests of the window until it
+    resets. The rate never leaves [min_rate, max_rate], max_rate None lets it grow until the server pushes back.
+    """
+
+    def __init__(self, rate, burst=None, adaptive=True, min_rate=0.1, max_rate=None, increase=None, decrease=0.5):
+        self.rate = float(rate)
+        self.burst = burst or max(1.0, self.rate)
+        self.adaptive = adaptive
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = self.rate * 0.05 if increase is None else increase
+        self.decrease = decrease
+        self.lock = threading.Lock()
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.last_adjust = self.updated
+        # No tokens are added before this deadline, set by Retry-After or an exhausted rate limit window
+        self.paused_until = 0.0
+        self.last_decrease = float("-inf")
+        self.throttled = 0
+        self.wait_time = 0.0
+
+    def clamp(self, rate):
+        rate = max(self.min_rate, rate)
+        return rate if self.max_rate is None else min(self.max_rate, rate)
+
+    def refill(self, now):
+        start = max(self.updated, self.paused_until)
+        if now > start:
+            self.tokens = min(self.burst, self.tokens + (now - start) * self.rate)
+        self.updated = max(self.updated, now)
+
+    def reserve(self):
+        """Takes a token and returns the seconds the caller has to wait before sending its request."""
+        with self.lock:
+            now = time.monotonic()
+            self.refill(now)
+            self.tokens -= 1
+            wait = max(0.0, self.paused_until - now) + (-self.tokens / self.rate if self.tokens < 0 else 0.0)
+            self.wait_time += wait
+            return wait
+
+    def acquire(self):
+        wait = self.reserve()
+        if wait:
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        import asyncio
+
+        wait = self.reserve()
+        if wait:
+            await asyncio.sleep(wait)
+
+    def pause(self, now, seconds):
+        # Concurrent throttled responses usually carry the same Retry-After, extending one deadline keeps them
+        # from adding up. One request goes out when the pause ends, the ones after it are paced instead of bursting.
+        self.paused_until = max(self.paused_until, now + seconds)
+        self.tokens = min(self.tokens, 1.0)
+
+    def observe(self, status_code, headers):
+        """Adjusts the bucket to a response of the host."""
+        if not self.adaptive:
+            return
+        headers = headers or {}
+        with self.lock:
+            now = time.monotonic()
+            self.refill(now)
+            window = get_rate_limit_window(headers)
+            if status_code in THROTTLED_STATUS_CODES:
+                self.throttled += 1
+                # Requests sent before the first throttled response come back throttled as well, they belong to the
+                # same window and must not cut the rate again. The window lasts while paused or for one request.
+                if now >= self.paused_until and now - self.last_decrease >= 1 / self.rate:
+                    self.rate = self.clamp(self.rate * self.decrease)
+                    self.last_decrease = now
+                self.last_adjust = now
+                delay = get_retry_after(headers)
+                if delay is None and window is not None and window[0] <= 0:
+                    delay = window[1]
+                if delay:
+                    self.pause(now, delay)
+                logger.debug(f"Throttled, lowered rate to {self.rate:.2f} requests/s")
+            elif window is not None:
+                # The server told us how much of its window is left, spread that over the time until it resets
+                remaining, reset = window
+                if remaining <= 0:
+                    self.pause(now, reset)
+                elif reset > 0:
+                    self.rate = self.clamp(remaining / reset)
+                self.last_adjust = now
+            else:
+                self.rate = self.clamp(self.rate + self.increase * (now - self.last_adjust))
+                self.last_adjust = now
+
+    def snapshot(self):
+        with self.lock:
+            return {"rate": round(self.rate, 3), "throttled": self.throttled, "wait_time": round(self.wait_time, 3)}
+
+
+# Hosts without a limiter are not paced
+rate_limit_config = {
+    "host_limiters": {},
+}
+
+
+def configure_rate_limits(host_limits):
+    """Sets the limiters used by call_api, host_limits maps a host to a RateLimiter or to a rate in requests/s."""
+    rate_limit_config["host_limiters"] = {
+        host: limit if isinstance(limit, RateLimiter) else RateLimiter(limit)
+        for host, limit in host_limits.items()
+    }
+
+
+def get_rate_limiter(url, rate_limiter=None):
+    if rate_limiter is not None:
+        return rate_limiter
+    return rate_limit_config["host_limiters"].get(urlsplit(url).hostname)
+
+
+def get_rate_limit_stats():
+    return {host: limiter.snapshot() for host, limiter in rate_limit_config["host_limiters"].items()}
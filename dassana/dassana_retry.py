@@ -0,0 +1,237 @@
+import logging
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Final
+from urllib.parse import urlsplit
+
+from .dassana_exception import ApiError
+
+logger: Final = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+# Reset headers holding a value this large are epoch timestamps rather than a number of seconds
+EPOCH_THRESHOLD = 1000 * 1000 * 1000
+
+
+class RetryStats:
+    """Thread safe count of retries and of the seconds spent sleeping before them, in total and per host."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.retries = 0
+        self.sleep_time = 0.0
+        self.hosts = {}
+
+    def record(self, host, delay):
+        with self.lock:
+            self.record_locked(host, delay)
+
+    def record_locked(self, host, delay):
+        self.retries += 1
+        self.sleep_time += delay
+        host_stats = self.hosts.setdefault(host, {"retries": 0, "sleep_time": 0.0})
+        host_stats["retries"] += 1
+        host_stats["sleep_time"] += delay
+
+    def snapshot(self):
+        with self.lock:
+            return {"retries": self.retries, "sleep_time": round(self.sleep_time, 3),
+                    "hosts": {host: {"retries": host_stats["retries"],
+                                     "sleep_time": round(host_stats["sleep_time"], 3)}
+                              for host, host_stats in self.hosts.items()}}
+
+
+class RetryBudget(RetryStats):
+    """Caps the retries and the backoff time one job may spend across all of its API calls.
+
+    Calls sharing a budget stop retrying once max_retries retries were made or the next sleep would push the
+    total past max_sleep seconds, None leaves that bound open. An unbounded budget still counts what was spent.
+    """
+
+    def __init__(self, max_retries=None, max_sleep=None):
+        super().__init__()
+        self.max_retries = max_retries
+        self.max_sleep = max_sleep
+
+    def try_spend(self, host, delay):
+        with self.lock:
+            if self.max_retries is not None and self.retries >= self.max_retries:
+                return False
+            if self.max_sleep is not None and self.sleep_time + delay > self.max_sleep:
+                return False
+            # Spent in the same critical section as the check so concurrent calls can not overshoot the budget
+            self.record_locked(host, delay)
+        return True
+
+
+class RetryPolicy:
+    """Decides whether a failed API call is retried and how long to wait before the next attempt.
+
+    The wait is multiplier * 2 ** (attempt - 1) seconds shortened by up to jitter of itself at random and then
+    clamped to [min_wait, max_wait]. A Retry-After or rate limit reset header on the response replaces the computed
+    wait, when it asks for more than max_retry_after seconds the call fails right away instead. max_elapsed
+    bounds the seconds a call may spend on all attempts together.
+    """
+
+    def __init__(self, max_attempts=3, multiplier=5, min_wait=30, max_wait=60, jitter=0.25, max_retry_after=300,
+                 max_elapsed=None, respect_retry_after=True):
+        self.max_attempts = max_attempts
+        self.multiplier = multiplier
+        self.min_wait = min_wait
+        self.max_wait = max_wait
+        self.jitter = jitter
+        self.max_retry_after = max_retry_after
+        self.max_elapsed = max_elapsed
+        self.respect_retry_after = respect_retry_after
+
+    def is_retryable(self, exp):
+        return isinstance(exp, ApiError) and exp.is_auto_recoverable
+
+    def backoff(self, attempt):
+        delay = self.multiplier * 2 ** (attempt - 1)
+        if self.jitter:
+            delay -= delay * self.jitter * random.random()
+        # Jitter goes first so no wait is ever shorter than min_wait
+        return min(self.max_wait, max(self.min_wait, delay))
+
+    def get_delay(self, exp, attempt, started):
+        """Returns the seconds to sleep before the next attempt, None when the call should not be retried."""
+        if not self.is_retryable(exp) or attempt >= self.max_attempts:
+            return None
+        delay = self.backoff(attempt)
+        if self.respect_retry_after:
+            server_delay = get_server_delay(exp)
+            if server_delay is not None:
+                if server_delay > self.max_retry_after:
+                    logger.warning(f"Server asked to retry in {server_delay:.0f}s, more than the "
+                                   f"{self.max_retry_after}s allowed")
+                    return None
+                delay = server_delay
+        if self.max_elapsed is not None and time.monotonic() - started + delay > self.max_elapsed:
+            return None
+        return delay
+
+    def next_delay(self, exp, attempt, started, host, budget):
+        delay = self.get_delay(exp, attempt, started)
+        if delay is None:
+            return None
+        if budget is not None and not budget.try_spend(host, delay):
+            logger.warning(f"Retry budget exhausted, not retrying request to {host}")
+            return None
+        retry_stats.record(host, delay)
+        logger.warning(f"Retrying request to {host} in {delay:.2f}s (attempt {attempt} of {self.max_attempts}) "
+                       f"as it raised {exp.__class__.__name__}: {exp}")
+        return delay
+
+    def call(self, url, func, *args, budget=None, **kwargs):
+        """Runs func(*args, **kwargs) until it succeeds or the policy gives up, url names the host for stats."""
+        host = urlsplit(url).netloc
+        started = time.monotonic()
+        attempt = 1
+        while True:
+            try:
+                return func(*args, **kwargs)
+            except Exception as exp:
+                delay = self.next_delay(exp, attempt, started, host, budget)
+                if delay is None:
+                    raise
+            time.sleep(delay)
+            attempt += 1
+
+    async def call_async(self, url, func, *args, budget=None, **kwargs):
+        import asyncio
+
+        host = urlsplit(url).netloc
+        started = time.monotonic()
+        attempt = 1
+        while True:
+            try:
+                return await func(*args, **kwargs)
+            except Exception as exp:
+                delay = self.next_delay(exp, attempt, started, host, budget)
+                if delay is None:
+                    raise
+            await asyncio.sleep(delay)
+            attempt += 1
+
+
+def get_header(headers, name):
+    # ApiResponse keeps headers in a plain dict, the case insensitive lookup of requests is gone by then
+    for key, value in headers.items():
+        if key.lower() == name:
+            return value
+    return None
+
+
+def get_retry_after(headers):
+    """Seconds asked for by a Retry-After header, either a number of seconds or an HTTP date."""
+    retry_after = get_header(headers, "retry-after")
+    if retry_after is None:
+        return None
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def get_rate_limit_window(headers):
+    """Returns (remaining requests, seconds until the window resets) from rate limit headers, None when absent."""
+    remaining = get_header(headers, "x-ratelimit-remaining") or get_header(headers, "ratelimit-remaining")
+    reset = get_header(headers, "x-ratelimit-reset") or get_header(headers, "ratelimit-reset")
+    if reset is None or remaining is None:
+        return None
+    try:
+        remaining = float(remaining)
+        reset = float(reset)
+    except ValueError:
+        return None
+    if reset >= EPOCH_THRESHOLD:
+        reset -= time.time()
+    return remaining, max(0.0, reset)
+
+
+def get_server_delay(exp):
+    """Seconds the server asked to wait through Retry-After or rate limit reset headers, None when it did not."""
+    http_response = getattr(exp, "http_response", None)
+    headers = getattr(http_response, "headers", None)
+    if not headers:
+        return None
+    if get_header(headers, "retry-after") is not None:
+        return get_retry_after(headers)
+    window = get_rate_limit_window(headers)
+    # Only wait for the reset when the window is actually used up
+    if window is None or window[0] > 0:
+        return None
+    return window[1]
+
+
+# Process wide retry counts, a RetryBudget passed to call_api counts the retries of one job on top of these
+retry_stats = RetryStats()
+retry_config = {
+    "default": RetryPolicy(),
+    "host_policies": {},
+}
+
+
+def configure_retries(default=None, host_policies=None):
+    """Replaces the policy used by call_api, host_policies maps a host to its own RetryPolicy."""
+    if default is not None:
+        retry_config["default"] = default
+    if host_policies is not None:
+        retry_config["host_policies"] = dict(host_policies)
+
+
+def get_retry_policy(url, retry_policy=None):
+    if retry_policy is not None:
+        return retry_policy
+    return retry_config["host_policies"].get(urlsplit(url).hostname, retry_config["default"])
+
+
+def get_retry_stats():
+    return retry_stats.snapshot()
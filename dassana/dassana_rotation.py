@@ -0,0 +1,92 @@
+import time
+
+
+class RotationPolicy:
+    """Decides when DassanaWriter closes the open chunk and hands it over for upload.
+
+    Policies can be combined with |, the chunk rotates as soon as any of them asks for it.
+    """
+
+    def should_rotate(self, chunk):
+        raise NotImplementedError
+
+    def remaining(self, chunk):
+        """Returns (bytes, records) that still fit into the chunk, None where the policy sets no bound.
+
+        Used to cut write batches on the record where the chunk fills up.
+        """
+        return None, None
+
+    def check_interval(self):
+        """Seconds between checks of idle chunks, None when the policy only changes on writes."""
+        return None
+
+    def __or__(self, other):
+        return AnyPolicy(self, other)
+
+
+class MaxSizePolicy(RotationPolicy):
+    def __init__(self, size_limit, compressed=False):
+        # size_limit is in MB, like DassanaWriter.file_size_limit
+        self.size_limit = int(size_limit * 1000 * 1000)
+        self.compressed = compressed
+
+    def should_rotate(self, chunk):
+        if self.compressed:
+            return chunk.compressed_bytes() >= self.size_limit
+        return chunk.bytes_written >= self.size_limit
+
+    def remaining(self, chunk):
+        if self.compressed:
+            return None, None
+        return self.size_limit - chunk.bytes_written, None
+
+
+class MaxRecordsPolicy(RotationPolicy):
+    def __init__(self, max_records):
+        self.max_records = int(max_records)
+
+    def should_rotate(self, chunk):
+        return chunk.records >= self.max_records
+
+    def remaining(self, chunk):
+        return None, self.max_records - chunk.records
+
+
+class MaxAgePolicy(RotationPolicy):
+    def __init__(self, max_age):
+        # max_age is in seconds, measured from the first record written to the chunk
+        self.max_age = max_age
+
+    def should_rotate(self, chunk):
+        return chunk.first_write_ts is not None and time.time() - chunk.first_write_ts >= self.max_age
+
+    def check_interval(self):
+        return max(1, self.max_age / 4)
+
+
+class AnyPolicy(RotationPolicy):
+    def __init__(self, *policies):
+        self.policies = []
+        for policy in policies:
+            if isinstance(policy, AnyPolicy):
+                self.policies.extend(policy.policies)
+            else:
+                self.policies.append(policy)
+
+    def should_rotate(self, chunk):
+        return any(policy.should_rotate(chunk) for policy in self.policies)
+
+    def remaining(self, chunk):
+        bytes_left = records_left = None
+        for policy in self.policies:
+            policy_bytes, policy_records = policy.remaining(chunk)
+            if policy_bytes is not None:
+                bytes_left = policy_bytes if bytes_left is None else min(bytes_left, policy_bytes)
+            if policy_records is not None:
+                records_left = policy_records if records_left is None else min(records_left, policy_records)
+        return bytes_left, records_left
+
+    def check_interval(self):
+        intervals = [policy.check_interval() for policy in self.policies if policy.check_interval()]
+        return min(intervals) if intervals else None
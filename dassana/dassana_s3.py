@@ -0,0 +1,105 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Final
+
+logger: Final = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+MIN_PART_SIZE = 5 * 1024 * 1024
+
+
+class S3MultipartWriter:
+    """Write-only file object that uploads everything written to it as an S3 multipart upload.
+
+    Parts of part_size bytes are uploaded in the background as soon as they fill up, at most concurrency at a
+    time, so memory stays bounded by roughly (concurrency + 1) * part_size. Can be used as the fileobj of a
+    GzipFile to upload a chunk while it is being compressed. close() uploads the last part and completes the
+    upload, abort() discards it. get_client is called for every request so refreshed credentials are picked up
+    by long running uploads.
+    """
+
+    def __init__(self, get_client, bucket, key, part_size=64 * 1024 * 1024, concurrency=4):
+        if part_size < MIN_PART_SIZE:
+            raise ValueError(f"S3 multipart part size must be at least {MIN_PART_SIZE} bytes")
+        self.get_client = get_client
+        self.bucket = bucket
+        self.key = key
+        self.part_size = part_size
+        self.buffer = bytearray()
+        self.bytes_written = 0
+        self.parts = []
+        self.futures = []
+        self.closed = False
+        self.part_slots = threading.BoundedSemaphore(concurrency)
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="dassana-s3-part")
+        response = self.get_client().create_multipart_upload(Bucket=bucket, Key=key)
+        self.upload_id = response["UploadId"]
+
+    def writable(self):
+        return True
+
+    def tell(self):
+        return self.bytes_written
+
+    def flush(self):
+        pass
+
+    def write(self, data):
+        if self.closed:
+            raise ValueError("write to closed S3 multipart upload")
+        self.buffer += data
+        self.bytes_written += len(data)
+        while len(self.buffer) >= self.part_size:
+            part = bytes(self.buffer[:self.part_size])
+            del self.buffer[:self.part_size]
+            self.submit_part(part)
+        return len(data)
+
+    def submit_part(self, part):
+        self.raise_failed_parts()
+        part_number = len(self.futures) + 1
+        self.part_slots.acquire()
+        try:
+            future = self.executor.submit(self.upload_part, part_number, part)
+        except Exception:
+            self.part_slots.release()
+            raise
+        future.add_done_callback(lambda _: self.part_slots.release())
+        self.futures.append(future)
+
+    def upload_part(self, part_number, part):
+        response = self.get_client().upload_part(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+                                                 PartNumber=part_number, Body=part)
+        return {"PartNumber": part_number, "ETag": response["ETag"]}
+
+    def raise_failed_parts(self):
+        for future in self.futures:
+            if future.done() and future.exception() is not None:
+                raise future.exception()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            if self.buffer or not self.futures:
+                self.submit_part(bytes(self.buffer))
+                self.buffer = bytearray()
+            self.parts = [future.result() for future in self.futures]
+            self.get_client().complete_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+                                                        MultipartUpload={"Parts": self.parts})
+            logger.info(f"Completed multipart upload of {self.bytes_written} bytes in {len(self.parts)} parts")
+        except Exception:
+            self.abort()
+            raise
+        finally:
+            self.executor.shutdown(wait=True)
+
+    def abort(self):
+        self.closed = True
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        try:
+            self.get_client().abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+        except Exception as exp:
+            logger.warning(f"Failed to abort multipart upload {self.upload_id} due to {exp}")
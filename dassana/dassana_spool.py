@@ -0,0 +1,253 @@
+import glob
+import gzip
+import json
+import logging
+import os
+import socket
+import threading
+import zlib
+from typing import Final
+
+logger: Final = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+MANIFEST_SUFFIX = ".manifest.json"
+LOCK_SUFFIX = ".lock"
+
+# The only parts of the job creation response written to disk, stage credentials are requested again on resume
+SPOOLED_JOB_FIELDS = ("jobId", "creationTs", "metadata")
+SPOOLED_STAGE_FIELDS = ("cloud", "bucket", "filePath")
+
+
+def lock_manifest(lock_path):
+    """Takes the exclusive lock of a manifest, returns its open lock file or None when another writer holds it.
+
+    The lock goes away with the process holding it, so a manifest whose lock can be taken has no live owner.
+    """
+    import fcntl
+    lock_file = open(lock_path, 'a+')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return None
+    lock_file.seek(0)
+    lock_file.truncate()
+    lock_file.write(json.dumps(get_owner()))
+    lock_file.flush()
+    return lock_file
+
+
+def get_owner():
+    return {"pid": os.getpid(), "hostname": socket.gethostname()}
+
+
+def get_spooled_job(job):
+    spooled_job = {field: job[field] for field in SPOOLED_JOB_FIELDS if field in job}
+    spooled_job["stageDetails"] = {field: job["stageDetails"][field] for field in SPOOLED_STAGE_FIELDS
+                                   if field in job.get("stageDetails", {})}
+    return spooled_job
+
+
+class JobSpool:
+    """Manifest of the chunks a job still has on local disk, kept next to the chunks in the spool directory.
+
+    Chunks are tracked as "open" while records are written to them and "pending" once rotated until their
+    upload completes. The writer owning the job holds the lock file of the manifest. A writer restarted after a
+    crash finds a manifest for its job id, or for its source, record type and config id, whose owner is gone and
+    uploads what is left instead of starting a new job.
+    """
+
+    def __init__(self, spool_dir, manifest, lock_file=None):
+        self.spool_dir = spool_dir
+        self.manifest = manifest
+        self.lock_file = lock_file
+        self.lock = threading.Lock()
+
+    @classmethod
+    def create(cls, spool_dir, source, record_type, config_id, job):
+        os.makedirs(spool_dir, exist_ok=True)
+        spool = cls(spool_dir, {
+            "job_id": job["jobId"],
+            "source": str(source),
+            "record_type": str(record_type),
+            "config_id": str(config_id),
+            "owner": get_owner(),
+            "job": get_spooled_job(job),
+            "checkpoint": None,
+            "chunks": {}
+        })
+        spool.lock_file = lock_manifest(spool.lock_path)
+        if spool.lock_file is None:
+            raise RuntimeError(f"Spool of job {spool.job_id} is locked by another writer")
+        spool.save()
+        return spool
+
+    @classmethod
+    def find(cls, spool_dir, source, record_type, config_id, job_id=None):
+        """Returns the spool of a job left behind by a writer that is gone, locked for this writer."""
+        if job_id is not None:
+            manifest_paths = [os.path.join(spool_dir, f"{job_id}{MANIFEST_SUFFIX}")]
+        else:
+            manifest_paths = sorted(glob.glob(os.path.join(spool_dir, f"*{MANIFEST_SUFFIX}")))
+        for manifest_path in manifest_paths:
+            if not os.path.exists(manifest_path):
+                continue
+            lock_file = lock_manifest(manifest_path[:-len(MANIFEST_SUFFIX)] + LOCK_SUFFIX)
+            if lock_file is None:
+                logger.info(f"Skipping spool manifest {manifest_path}, its job is still running")
+                continue
+            # Read only once locked, the owner may have finished and removed it in the meantime
+            try:
+                with open(manifest_path) as manifest_file:
+                    manifest = json.load(manifest_file)
+            except FileNotFoundError:
+                manifest = None
+            except (OSError, ValueError) as exp:
+                logger.warning(f"Ignoring unreadable spool manifest {manifest_path} due to {exp}")
+                manifest = None
+            if manifest is not None and (job_id is not None or (
+                    manifest.get("source"), manifest.get("record_type"), manifest.get("config_id")) == (
+                    str(source), str(record_type), str(config_id))):
+                logger.info(f"Taking over spooled job {manifest['job_id']} from {manifest.get('owner')}")
+                manifest["owner"] = get_owner()
+                return cls(spool_dir, manifest, lock_file)
+            lock_file.close()
+        return None
+
+    @property
+    def job_id(self):
+        return self.manifest["job_id"]
+
+    @property
+    def job(self):
+        return self.manifest["job"]
+
+    @property
+    def checkpoint(self):
+        return self.manifest["checkpoint"]
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.spool_dir, f"{self.job_id}{MANIFEST_SUFFIX}")
+
+    @property
+    def lock_path(self):
+        return os.path.join(self.spool_dir, f"{self.job_id}{LOCK_SUFFIX}")
+
+    def chunk_path(self, file_name):
+        return os.path.join(self.spool_dir, file_name)
+
+    def chunks(self):
+        with self.lock:
+            return dict(self.manifest["chunks"])
+
+    def save(self):
+        # Write to a temporary file and rename so a crash never leaves a half written manifest behind
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, 'w') as manifest_file:
+            json.dump(self.manifest, manifest_file)
+        os.replace(tmp_path, self.manifest_path)
+
+    def add_chunk(self, file_path, compressed):
+        with self.lock:
+            self.manifest["chunks"][file_path] = {"status": "open", "compressed": compressed}
+            self.save()
+
+    def close_chunk(self, file_path):
+        with self.lock:
+            if file_path in self.manifest["chunks"]:
+                self.manifest["chunks"][file_path]["status"] = "pending"
+                self.save()
+
+    def remove_chunk(self, file_path):
+        with self.lock:
+            if self.manifest["chunks"].pop(file_path, None) is not None:
+                self.save()
+
+    def set_checkpoint(self, checkpoint):
+        with self.lock:
+            self.manifest["checkpoint"] = checkpoint
+            self.save()
+
+    def remove(self, remove_chunks=False):
+        with self.lock:
+            if remove_chunks:
+                for file_path in self.manifest["chunks"]:
+                    for file_name in (file_path, f"{file_path}.gz"):
+                        if os.path.exists(file_name):
+                            os.remove(file_name)
+            if os.path.exists(self.manifest_path):
+                os.remove(self.manifest_path)
+            self.release()
+
+    def release(self):
+        """Gives up the lock, the manifest stays for a later writer to resume."""
+        if self.lock_file is not None:
+            if not os.path.exists(self.manifest_path) and os.path.exists(self.lock_path):
+                os.remove(self.lock_path)
+            self.lock_file.close()
+            self.lock_file = None
+
+
+RECOVERY_BLOCK_SIZE = 1024 * 1024
+# Compressed bytes lost at most when a block of a spooled chunk turns out to be corrupted
+RECOVERY_PIECE_SIZE = 4 * 1024
+
+
+def recover_chunk(file_path, compressed):
+    """Cuts a chunk left open by a crashed writer back to its last complete record.
+
+    Returns the number of bytes of records that survived, 0 when nothing is left to upload.
+    """
+    if compressed:
+        return recover_compressed_chunk(f"{file_path}.gz")
+    if not os.path.exists(file_path):
+        return 0
+    with open(file_path, 'rb+') as chunk_file:
+        # Only the tail after the last newline is cut, look for it from the end a block at a time
+        end = chunk_file.seek(0, os.SEEK_END)
+        size = 0
+        while end > 0:
+            start = max(0, end - RECOVERY_BLOCK_SIZE)
+            chunk_file.seek(start)
+            newline = chunk_file.read(end - start).rfind(b'\n')
+            if newline != -1:
+                size = start + newline + 1
+                break
+            end = start
+        chunk_file.truncate(size)
+    return size
+
+
+def recover_compressed_chunk(file_name):
+    if not os.path.exists(file_name):
+        return 0
+    # A gzip stream cut off by a crash has no trailer, decompress whatever made it to disk into a new gzip file.
+    # Only the record still missing its newline is held in memory.
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    tmp_name = f"{file_name}.recover"
+    size = 0
+    partial = bytearray()
+    corrupted = False
+    with open(file_name, 'rb') as chunk_file, gzip.open(tmp_name, 'wb') as recovered_file:
+        while not corrupted and (block := chunk_file.read(RECOVERY_BLOCK_SIZE)):
+            intact = decompressor.copy()
+            try:
+                partial += decompressor.decompress(block)
+            except zlib.error as exp:
+                # Keep what the block holds before the corruption, decompressing it again in small pieces
+                for start in range(0, len(block), RECOVERY_PIECE_SIZE):
+                    try:
+                        partial += intact.decompress(block[start:start + RECOVERY_PIECE_SIZE])
+                    except zlib.error:
+                        break
+                logger.warning(f"Spooled chunk {file_name} is corrupted past {size + len(partial)} bytes due to {exp}")
+                corrupted = True
+            newline = partial.rfind(b'\n')
+            if newline != -1:
+                recovered_file.write(partial[:newline + 1])
+                size += newline + 1
+                del partial[:newline + 1]
+    os.replace(tmp_name, file_name)
+    return size
@@ -0,0 +1,53 @@
+import ujson
+
+from .api import call_api
+
+CHUNK_SIZE = 64 * 1024
+
+
+def iter_ndjson(response, chunk_size=CHUNK_SIZE):
+    """Yields the records of a newline delimited JSON body as its bytes arrive."""
+    record = bytearray()
+    for block in response.iter_content(chunk_size=chunk_size):
+        start = 0
+        while (end := block.find(b'\n', start)) != -1:
+            record += block[start:end]
+            if record.strip():
+                yield ujson.loads(bytes(record))
+            record.clear()
+            start = end + 1
+        record += block[start:]
+    if record.strip():
+        yield ujson.loads(bytes(record))
+
+
+def iter_json_items(response, records_path=None):
+    """Yields the items of the array at records_path ("data.items", None for a top level array) of a JSON body.
+
+    Parsing is incremental, only the item being parsed is held in memory. Needs the ijson package.
+    """
+    try:
+        import ijson
+    except ImportError:
+        raise ImportError("streaming JSON parsing requested but ijson is not installed, install dassana[stream]")
+    prefix = f"{records_path}.item" if records_path else "item"
+    # Let urllib3 undo any gzip or deflate content encoding while ijson reads from the socket
+    response.raw.decode_content = True
+    yield from ijson.items(response.raw, prefix, use_float=True)
+
+
+def stream_records(method, url, records_path=None, ndjson=False, **call_api_kwargs):
+    """Calls call_api in streaming mode and yields records while the response body is still arriving.
+
+    ndjson reads one record per line, otherwise the records are the items of the JSON array at records_path.
+    Peak memory is bounded by the largest record instead of the whole body. The connection goes back to the
+    pool once the generator is exhausted or closed.
+    """
+    response = call_api(method, url, stream=True, **call_api_kwargs)
+    try:
+        if ndjson:
+            yield from iter_ndjson(response)
+        else:
+            yield from iter_json_items(response, records_path)
+    finally:
+        response.close()
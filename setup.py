@@ -10,6 +10,8 @@ setup(
     author_email="support@dassana.io",
     license="MIT",
     packages=["dassana"],
-    install_requires=["certifi", "requests", "urllib3", "google-cloud-pubsub", "google-cloud-storage", "boto3", "ujson", "tenacity"],
+    install_requires=["certifi", "requests", "urllib3", "google-cloud-pubsub", "google-cloud-storage", "boto3", "ujson>=5.1"],
+    extras_require={"orjson": ["orjson"], "zstd": ["zstandard"], "async": ["aiohttp"],
+                    "stream": ["ijson>=3.1"]},
     zip_safe=False,
 )
\ No newline at end of file
@@ -0,0 +1,60 @@
+import gzip
+import io
+import random
+import zlib
+
+import pytest
+
+from dassana.dassana_compression import DICT_SIZE, ParallelGzipFile
+
+
+def build_records(count):
+    rng = random.Random(7)
+    return b"".join(b'{"id":%d,"value":"%s"}\n' % (i, rng.choice([b"a", b"bb", b"ccc"]) * rng.randint(1, 50))
+                    for i in range(count))
+
+
+@pytest.mark.parametrize("block_size", [1000, DICT_SIZE, 3 * DICT_SIZE + 17])
+def test_round_trip_across_block_boundaries(block_size):
+    data = build_records(20000)
+    output = io.BytesIO()
+    with ParallelGzipFile(output, threads=3, block_size=block_size) as gzip_file:
+        # Writes of uneven size so blocks are cut in the middle of writes
+        offset = 0
+        for size in [1, block_size - 1, block_size, block_size + 1, 7 * block_size // 3] * 8:
+            gzip_file.write(data[offset:offset + size])
+            offset += size
+        gzip_file.write(data[offset:])
+    assert len(data) > 10 * block_size
+    assert gzip.decompress(output.getvalue()) == data
+
+
+def test_empty_input():
+    output = io.BytesIO()
+    ParallelGzipFile(output, threads=2).close()
+    assert gzip.decompress(output.getvalue()) == b""
+
+
+def test_close_keeps_fileobj_open_and_is_idempotent():
+    output = io.BytesIO()
+    gzip_file = ParallelGzipFile(output, threads=2)
+    gzip_file.write(b"record\n")
+    gzip_file.close()
+    gzip_file.close()
+    assert not output.closed
+    assert gzip.decompress(output.getvalue()) == b"record\n"
+    with pytest.raises(ValueError):
+        gzip_file.write(b"late\n")
+
+
+def test_flush_makes_written_data_decompressible():
+    data = build_records(2000)
+    output = io.BytesIO()
+    gzip_file = ParallelGzipFile(output, threads=2, block_size=4096)
+    gzip_file.write(data[:10000])
+    gzip_file.flush()
+    # Everything written before the flush is readable from the unfinished stream
+    assert zlib.decompressobj(16 + zlib.MAX_WBITS).decompress(output.getvalue()) == data[:10000]
+    gzip_file.write(data[10000:])
+    gzip_file.close()
+    assert gzip.decompress(output.getvalue()) == data
@@ -0,0 +1,73 @@
+import gzip
+import zlib
+
+from dassana import dassana_spool
+from dassana.dassana_spool import recover_chunk, recover_compressed_chunk
+
+RECORDS = b"".join(b'{"id":%d}\n' % i for i in range(5000))
+
+
+def write_crashed_gzip(file_name, records, tail):
+    # A writer killed mid-chunk leaves a stream flushed up to some point, without the gzip trailer
+    with open(file_name, "wb") as raw_file:
+        gzip_file = gzip.GzipFile(fileobj=raw_file, mode="wb")
+        gzip_file.write(records)
+        gzip_file.flush()
+        gzip_file.write(tail)
+        raw_file.write(gzip_file.compress.flush(zlib.Z_SYNC_FLUSH))
+
+
+def test_truncated_plain_chunk_is_cut_to_last_record(tmp_path):
+    chunk = tmp_path / "1-a.ndjson"
+    chunk.write_bytes(RECORDS + b'{"id":50')
+    assert recover_chunk(str(chunk), compressed=False) == len(RECORDS)
+    assert chunk.read_bytes() == RECORDS
+
+
+def test_plain_chunk_searched_across_recovery_blocks(tmp_path, monkeypatch):
+    monkeypatch.setattr(dassana_spool, "RECOVERY_BLOCK_SIZE", 16)
+    chunk = tmp_path / "1-a.ndjson"
+    chunk.write_bytes(b'{"id":1}\n' + b"x" * 100)
+    assert recover_chunk(str(chunk), compressed=False) == 9
+    assert chunk.read_bytes() == b'{"id":1}\n'
+
+
+def test_plain_chunk_without_complete_record(tmp_path):
+    chunk = tmp_path / "1-a.ndjson"
+    chunk.write_bytes(b'{"id":1')
+    assert recover_chunk(str(chunk), compressed=False) == 0
+    assert chunk.read_bytes() == b""
+    assert recover_chunk(str(tmp_path / "missing.ndjson"), compressed=False) == 0
+
+
+def test_truncated_gzip_chunk_keeps_complete_records(tmp_path):
+    chunk = tmp_path / "1-a.ndjson"
+    write_crashed_gzip(f"{chunk}.gz", RECORDS, b'{"id":50')
+    assert recover_chunk(str(chunk), compressed=True) == len(RECORDS)
+    assert gzip.decompress((tmp_path / "1-a.ndjson.gz").read_bytes()) == RECORDS
+
+
+def test_gzip_chunk_cut_mid_block(tmp_path, monkeypatch):
+    monkeypatch.setattr(dassana_spool, "RECOVERY_BLOCK_SIZE", 64)
+    chunk = tmp_path / "1-a.ndjson.gz"
+    write_crashed_gzip(str(chunk), RECORDS, b"")
+    flushed = chunk.read_bytes()
+    # Drop the end of the last deflate block, only records decoded before the cut survive
+    chunk.write_bytes(flushed[:len(flushed) // 2])
+    size = recover_compressed_chunk(str(chunk))
+    recovered = gzip.decompress(chunk.read_bytes())
+    assert len(recovered) == size
+    assert 0 < size < len(RECORDS)
+    assert RECORDS.startswith(recovered) and recovered.endswith(b"\n")
+
+
+def test_corrupted_gzip_chunk_keeps_records_before_corruption(tmp_path, monkeypatch):
+    # Byte sized pieces lose nothing in front of the corruption
+    monkeypatch.setattr(dassana_spool, "RECOVERY_PIECE_SIZE", 1)
+    chunk = tmp_path / "1-a.ndjson.gz"
+    write_crashed_gzip(str(chunk), RECORDS, b"")
+    with open(chunk, "ab") as chunk_file:
+        chunk_file.write(b"\xff" * 64)
+    assert recover_compressed_chunk(str(chunk)) == len(RECORDS)
+    assert gzip.decompress(chunk.read_bytes()) == RECORDS
+    assert recover_compressed_chunk(str(tmp_path / "missing.ndjson.gz")) == 0